@@ -0,0 +1,252 @@
+import numpy as np
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from constraints import Constraints, default_constraints
+from gc_profile import base_codes, gc_sums, window_gc
+from tandem_repeats import repeat_counts
+
+# Default number of bases in each window whose GC content is checked.
+GC_WINDOW = 10
+
+# Number of sequences sent to a worker process at a time.
+BATCH_SIZE = 256
+
+# Batches in flight at once per worker, bounding the memory used while auditing.
+BATCHES_PER_WORKER = 4
+
+
+@dataclass
+class SequenceReport:
+    name: str
+    length: int
+    invalid_bases: int
+    gc: float
+    min_window_gc: float
+    max_window_gc: float
+    gc_violations: int
+    longest_run: int
+    long_runs: int
+    tandem_repeats: int
+    reserved_hits: int
+
+    @property
+    def passed(self) -> bool:
+        return (
+            self.invalid_bases == 0
+            and self.gc_violations == 0
+            and self.long_runs == 0
+            and self.tandem_repeats == 0
+            and self.reserved_hits == 0
+        )
+
+    def __str__(self):
+        return (
+            f"{self.name}: length {self.length}, GC {self.gc:.3f} "
+            + f"({self.min_window_gc:.3f} - {self.max_window_gc:.3f} windowed), "
+            + f"GC window violations: {self.gc_violations}, "
+            + f"longest run: {self.longest_run}, long runs: {self.long_runs}, "
+            + f"tandem repeats: {self.tandem_repeats}, "
+            + f"reserved hits: {self.reserved_hits}, "
+            + f"invalid bases: {self.invalid_bases}"
+        )
+
+
+# Totals over every audited sequence, along with how many sequences broke each
+# constraint at least once.
+@dataclass
+class PoolReport:
+    sequences: int = 0
+    bases: int = 0
+    gc_bases: int = 0
+    invalid_bases: int = 0
+    gc_violations: int = 0
+    long_runs: int = 0
+    tandem_repeats: int = 0
+    reserved_hits: int = 0
+    longest_run: int = 0
+    failing: dict = field(
+        default_factory=lambda: {
+            "invalid": 0,
+            "gc": 0,
+            "runs": 0,
+            "repeats": 0,
+            "reserved": 0,
+            "any": 0,
+        }
+    )
+
+    def add(self, report: SequenceReport):
+        self.sequences += 1
+        self.bases += report.length
+        self.gc_bases += round(report.gc * (report.length - report.invalid_bases))
+        self.invalid_bases += report.invalid_bases
+        self.gc_violations += report.gc_violations
+        self.long_runs += report.long_runs
+        self.tandem_repeats += report.tandem_repeats
+        self.reserved_hits += report.reserved_hits
+        self.longest_run = max(self.longest_run, report.longest_run)
+
+        self.failing["invalid"] += report.invalid_bases > 0
+        self.failing["gc"] += report.gc_violations > 0
+        self.failing["runs"] += report.long_runs > 0
+        self.failing["repeats"] += report.tandem_repeats > 0
+        self.failing["reserved"] += report.reserved_hits > 0
+        self.failing["any"] += not report.passed
+
+    def __str__(self):
+        valid = self.bases - self.invalid_bases
+        return (
+            f"Sequences: {self.sequences}\n"
+            + f"Bases: {self.bases}\n"
+            + f"GC content: {self.gc_bases / valid if valid else 0.0}\n"
+            + f"Longest run: {self.longest_run}\n"
+            + f"GC window violations: {self.gc_violations} "
+            + f"in {self.failing['gc']} sequences\n"
+            + f"Runs over the limit: {self.long_runs} "
+            + f"in {self.failing['runs']} sequences\n"
+            + f"Tandem repeats: {self.tandem_repeats} "
+            + f"in {self.failing['repeats']} sequences\n"
+            + f"Reserved hits: {self.reserved_hits} "
+            + f"in {self.failing['reserved']} sequences\n"
+            + f"Invalid bases: {self.invalid_bases} "
+            + f"in {self.failing['invalid']} sequences\n"
+            + f"Sequences failing any check: {self.failing['any']}"
+        )
+
+
+# Reads (name, sequence) pairs one at a time from a FASTA file, or from a plain
+# text file with one sequence per line, which are named by their line number.
+# Only the sequence being read is held in memory.
+def read_sequences(path: str):
+    with open(path) as f:
+        name = None
+        parts = []
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if line.startswith(">"):
+                if name is not None:
+                    yield name, "".join(parts)
+                name = line[1:].strip()
+                parts = []
+            elif name is not None:
+                parts.append(line.upper())
+            elif line:
+                yield str(number), line.upper()
+
+        if name is not None:
+            yield name, "".join(parts)
+
+
+# Checks one sequence against the constraints: GC content of every window of
+# the given size, homopolymer runs longer than the maximum run length, adjacent
+# tandem repeats of str_lower to str_upper bases and positions where a reserved
+# subsequence ends. Invalid bases count as neither GC nor AT, break runs and are
+# never part of a repeat.
+def audit_sequence(
+    name: str, sequence: str, constraints: Constraints, window: int = GC_WINDOW
+) -> SequenceReport:
+    codes = base_codes(sequence)
+    n = len(codes)
+    valid = codes < 4
+
+    gc = 0.0
+    windows = np.zeros(0)
+    if n > 0:
+        sums = gc_sums(codes)
+        counts = np.concatenate(([0], np.cumsum(valid)))
+        window = min(window, n)
+        # Windows of nothing but invalid bases have no GC content to check.
+        starts = np.arange(n - window + 1)
+        starts = starts[counts[starts + window] > counts[starts]]
+        windows = window_gc(sums, window, starts, counts)
+        gc = sums[-1] / max(int(valid.sum()), 1)
+    outside = (windows < constraints.gc_min) | (windows > constraints.gc_max)
+
+    # Runs start wherever the base changes.
+    starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+    lengths = np.diff(np.append(starts, n))
+    lengths = lengths[valid[starts]] if n > 0 else lengths
+
+    repeats = 0
+    if constraints.str_upper >= 1:
+        lower = max(constraints.str_lower, 1)
+        counts = repeat_counts(codes, lower, constraints.str_upper, valid=valid)
+        repeats = sum(counts.values())
+
+    return SequenceReport(
+        name=name,
+        length=n,
+        invalid_bases=int(n - valid.sum()),
+        gc=float(gc),
+        min_window_gc=float(windows.min()) if len(windows) else 0.0,
+        max_window_gc=float(windows.max()) if len(windows) else 0.0,
+        gc_violations=int(outside.sum()),
+        longest_run=int(lengths.max()) if len(lengths) else 0,
+        long_runs=int((lengths > constraints.max_run_length).sum()),
+        tandem_repeats=repeats,
+        reserved_hits=constraints.matcher.count(sequence),
+    )
+
+
+def audit_batch(
+    batch: list[tuple[str, str]], constraints: Constraints, window: int
+) -> list[SequenceReport]:
+    return [audit_sequence(name, seq, constraints, window) for name, seq in batch]
+
+
+# Audits every sequence in a FASTA or plain text file, yielding a report per
+# sequence in file order. Batches of sequences are audited in a process pool
+# with only a few batches per worker in flight, so memory stays bounded however
+# large the file is. Uses a worker per CPU unless told otherwise.
+def audit_file(
+    path: str,
+    constraints: Constraints,
+    window: int = GC_WINDOW,
+    workers: int = None,
+    batch_size: int = BATCH_SIZE,
+):
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        limit = workers * BATCHES_PER_WORKER
+        pending = []
+        batch = []
+
+        for record in read_sequences(path):
+            batch.append(record)
+            if len(batch) == batch_size:
+                pending.append(pool.submit(audit_batch, batch, constraints, window))
+                batch = []
+            if len(pending) >= limit:
+                yield from pending.pop(0).result()
+
+        if batch:
+            pending.append(pool.submit(audit_batch, batch, constraints, window))
+        for future in pending:
+            yield from future.result()
+
+
+def aggregate(reports) -> PoolReport:
+    pool = PoolReport()
+    for report in reports:
+        pool.add(report)
+    return pool
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        raise Exception("Usage: python auditor.py <sequences file> [symbol size]")
+
+    symbol_size = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    constraints = default_constraints(symbol_size=symbol_size)
+    pool = PoolReport()
+
+    for report in audit_file(sys.argv[1], constraints):
+        pool.add(report)
+        if not report.passed:
+            print(report)
+
+    print("======================== AUDIT RESULTS ========================")
+    print(constraints)
+    print(pool)
@@ -0,0 +1,106 @@
+import numpy as np
+
+BASES = "ACGT"
+
+
+# Aho-Corasick automaton over DNA bases matching any of a set of patterns, stored
+# as a complete transition table so that every base is a single lookup.
+# delta[state, base] is the state after reading base, with bases numbered as in
+# dna_mapping, and accept[state] is set once any pattern has just been read.
+# Patterns with characters other than A, C, G and T can never occur in DNA and
+# are left out.
+class Automaton:
+    def __init__(self, patterns: list[str]):
+        self.reserved = list(patterns)
+        self.patterns = [p for p in patterns if all(base in BASES for base in p)]
+
+        # Length of the longest pattern given, including any left out.
+        self.longest = max((len(p) for p in patterns), default=0)
+
+        goto = [[-1] * len(BASES)]
+        accept = [False]
+        for pattern in self.patterns:
+            state = 0
+            for base in pattern:
+                b = BASES.index(base)
+                if goto[state][b] < 0:
+                    goto[state][b] = len(goto)
+                    goto.append([-1] * len(BASES))
+                    accept.append(False)
+                state = goto[state][b]
+            accept[state] = True
+
+        # Breadth first, so every failure link points to a state already complete.
+        fail = [0] * len(goto)
+        queue = []
+        for b in range(len(BASES)):
+            if goto[0][b] < 0:
+                goto[0][b] = 0
+            else:
+                queue.append(goto[0][b])
+
+        for state in queue:
+            accept[state] = accept[state] or accept[fail[state]]
+            for b in range(len(BASES)):
+                next = goto[state][b]
+                if next < 0:
+                    goto[state][b] = goto[fail[state]][b]
+                else:
+                    fail[next] = goto[fail[state]][b]
+                    queue.append(next)
+
+        self.delta = np.array(goto, dtype=np.int32)
+        self.accept = np.array(accept, dtype=bool)
+        self._delta = goto
+        self._accept = accept
+
+    @property
+    def num_states(self) -> int:
+        return len(self.delta)
+
+    # Whether any pattern occurs in the given DNA string, in one pass over it.
+    # Other characters cannot be part of a match and return to the start state.
+    def search(self, sequence: str) -> bool:
+        if self._accept[0]:
+            return True
+
+        delta = self._delta
+        accept = self._accept
+        state = 0
+        for base in sequence:
+            b = BASES.find(base)
+            state = delta[state][b] if b >= 0 else 0
+            if accept[state]:
+                return True
+        return False
+
+    # Number of positions in the given DNA string at which some pattern ends.
+    def count(self, sequence: str) -> int:
+        if self._accept[0]:
+            return len(sequence) + 1
+
+        delta = self._delta
+        accept = self._accept
+        state = 0
+        hits = 0
+        for base in sequence:
+            b = BASES.find(base)
+            state = delta[state][b] if b >= 0 else 0
+            hits += accept[state]
+        return hits
+
+    # Runs integer-encoded DNA sequences of the given number of bases through the
+    # automaton from the given start states, which broadcast against them.
+    # Returns the final states and whether any pattern was read on the way.
+    def run(
+        self, sequences: np.ndarray, length: int, start=0
+    ) -> tuple[np.ndarray, np.ndarray]:
+        start = np.asarray(start, dtype=np.int32)
+        shape = np.broadcast_shapes(start.shape, np.shape(sequences))
+        state = np.broadcast_to(start, shape)
+        found = self.accept[state]
+        for j in range(length):
+            base = (sequences >> (2 * (length - 1 - j))) & 3
+            state = self.delta[state, base]
+            found = found | self.accept[state]
+        return state, found
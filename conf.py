@@ -6,7 +6,8 @@ from dna_mapping import bits_to_dna, dna_to_bits
 from experiments import Parameters
 from fsm import construct_fsm_from_constraints
 from graphing import plot_confusion
-from utils import confusion, inject_base_errors, rand_bit_string
+from metrics import confusion
+from utils import inject_base_errors, rand_bit_string
 
 
 def calc_confusion(
@@ -1,5 +1,6 @@
-from dataclasses import dataclass
-from utils import gc_content, longest_homopolymer, contains_reserved
+from automaton import Automaton
+from dataclasses import dataclass, field
+from utils import gc_content, longest_homopolymer
 
 
 @dataclass
@@ -10,6 +11,25 @@ class Constraints:
     str_upper: int
     max_run_length: int
     reserved: list[str]
+    _matcher: Automaton = field(default=None, init=False, repr=False, compare=False)
+
+    # The reserved subsequences compiled into a single automaton, found in one
+    # pass over a sequence. Compiled on first use and again if reserved changes.
+    @property
+    def matcher(self) -> Automaton:
+        if self._matcher is None or self._matcher.reserved != self.reserved:
+            self._matcher = Automaton(self.reserved)
+        return self._matcher
+
+    # Checking for reserved subsequences in a sequence shorter than one of them
+    # is taken to be a mistake.
+    def check_reserved_length(self, length: int):
+        if self.matcher.longest > length:
+            raise Exception("Reserved subsequence is longer than the given sequence.")
+
+    def contains_reserved(self, sequence: str) -> bool:
+        self.check_reserved_length(len(sequence))
+        return self.matcher.search(sequence)
 
     def satisfied(self, sequence: str) -> bool:
         gc = gc_content(sequence)
@@ -17,7 +37,7 @@ class Constraints:
             self.gc_min <= gc
             and gc <= self.gc_max
             and longest_homopolymer(sequence) <= self.max_run_length
-            and not contains_reserved(sequence, self.reserved)
+            and not self.contains_reserved(sequence)
         )
 
     def __str__(self):
@@ -100,7 +120,7 @@ def default_constraints(
         for i in range(len(primer) - concat_size + 1):
             regexes.append(primer[i : i + concat_size])
 
-    return Constraints(gc_min, gc_max, max_run_length, regexes)
+    return Constraints(gc_min, gc_max, str_lower, str_upper, max_run_length, regexes)
 
 
 
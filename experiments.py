@@ -10,7 +10,9 @@ from constraints import Constraints, default_constraints
 from data_types import Path
 from dna_mapping import bits_to_dna, dna_to_bits
 from fsm import construct_fsm_from_constraints
-from utils import confusion, hamming_dist, inject_base_errors, rand_bit_string
+from fsm_cache import cached_fsm
+from metrics import repetition_errors
+from utils import confusion, inject_base_errors, rand_bit_string
 
 
 @dataclass
@@ -51,6 +53,7 @@ def run_experiment(
     params: Parameters = Parameters(),
     verbose: bool = True,
     rust: bool = True,
+    cache: bool = True,
 ):
     output_size = 2 * params.symbol_size
 
@@ -75,13 +78,25 @@ def run_experiment(
             params.random_seed,
         )
     else:
-        fsm = construct_fsm_from_constraints(
-            init_state,
-            input_size,
-            output_size,
-            params.constraints,
-            params.choice_mechanism,
-        )
+        # The cache restores the random state building would have left, so seeded
+        # experiments are unchanged by it.
+        if cache:
+            fsm = cached_fsm(
+                init_state,
+                input_size,
+                output_size,
+                params.constraints,
+                params.choice_mechanism,
+                params.random_seed,
+            )
+        else:
+            fsm = construct_fsm_from_constraints(
+                init_state,
+                input_size,
+                output_size,
+                params.constraints,
+                params.choice_mechanism,
+            )
 
     # conf = confusion()
 
@@ -140,27 +155,24 @@ def run_experiment(
         # The estimated correct DNA sequence.
         dna_cor = bits_to_dna(observed)
 
-        # Add data to confusion matrix
-        # conf += confusion(dna, dna_cor)
-
         if not rust:
             # Estimate of the content of the original sequence.
             result = path.sequence
 
-        # Number of errors occuring in the DNA.
-        dna_error = hamming_dist(dna, dna_err)
-
-        # Number of errors remaining after DNA sequence is corrected.
-        rem_dna_error = hamming_dist(dna, dna_cor)
-
-        # Number of errors between the encoded and received strings.
-        bit_error = hamming_dist(enc, err)
-
-        # Number of errors remaining after the received string is corrected.
-        rem_bit_error = hamming_dist(enc, observed)
+        # Errors occuring in the DNA and remaining after it is corrected, between
+        # the encoded and received strings and remaining after the received
+        # string is corrected, and in the decoded sequence.
+        errors = repetition_errors(
+            seq, result, enc, err, observed, dna, dna_err, dna_cor
+        )
+        dna_error = errors.dna_injected
+        rem_dna_error = errors.dna_remaining
+        bit_error = errors.bits_injected
+        rem_bit_error = errors.bits_remaining
+        seq_error = errors.sequence
 
-        # Number of errors in the decoded sequence.
-        seq_error = hamming_dist(seq, result)
+        # Add data to confusion matrix
+        # conf += errors.confusion
 
         dna_errors_injected.append(dna_error)
         dna_errors_remaining.append(rem_dna_error)
@@ -0,0 +1,222 @@
+import numpy as np
+from automaton import Automaton
+from constraints import Constraints
+
+# Rough number of candidate sequences checked at once, bounding working memory.
+CHUNK_SIZE = 2**20
+
+# Number of sets of output summaries kept between calls to feasibility_mask.
+SUMMARY_CACHE_SIZE = 4
+
+# Summaries of every output symbol with the automaton for the reserved patterns,
+# keyed by output size and constraints.
+_outputs = {}
+
+
+# What the constraints need to know about integer-encoded DNA sequences of the
+# given number of bases to be checked on the concatenation of two of them: the
+# GC count, the longest run, and the base and length of the leading and trailing
+# runs.
+class Summary:
+    def __init__(self, sequences: np.ndarray, length: int):
+        self.gc = np.zeros(sequences.shape, dtype=np.int64)
+        self.longest = np.zeros(sequences.shape, dtype=np.int64)
+        self.lead = np.zeros(sequences.shape, dtype=np.int64)
+        leading = np.ones(sequences.shape, dtype=bool)
+
+        for j in range(length):
+            base = (sequences >> (2 * (length - 1 - j))) & 3
+            self.gc += (base == 1) | (base == 2)
+            if j == 0:
+                self.first = base
+                run = np.ones(sequences.shape, dtype=np.int64)
+            else:
+                run = np.where(base == prev, run + 1, 1)
+                leading &= base == self.first
+            self.lead += leading
+            self.longest = np.maximum(self.longest, run)
+            prev = base
+
+        self.last = prev
+        self.trail = run
+
+
+# Evaluates the constraints on every state + reserved + input concatenation at
+# once, returning ok[state, reserved, input]. Each concatenation is held as the
+# integer value of its bits, so base j of it is a two-bit field which is G or C
+# when its bits differ. States may be restricted to the given integer values.
+#
+# Rather than scanning every concatenation, each state and each output symbol is
+# summarised once and the summaries are combined: GC counts add, the longest run
+# is the longest of either side or the trailing run of the state joined to the
+# leading run of the output, and a reserved pattern occurs if the automaton hits
+# one reading the state, or reading the output from where the state left it.
+def feasibility_mask(
+    input_size: int,
+    output_size: int,
+    constraints: Constraints,
+    states: np.ndarray = None,
+) -> np.ndarray:
+    if states is None:
+        states = np.arange(2**output_size)
+    states = np.asarray(states, dtype=np.int64)
+
+    reserved_size = output_size - input_size
+    mask = np.empty((len(states), 2**output_size), dtype=bool)
+    step = max(1, CHUNK_SIZE // 2**output_size)
+
+    for start in range(0, len(states), step):
+        gc, longest, reserved = concatenations(
+            output_size, constraints, states[start : start + step]
+        )
+        content = gc / output_size
+        mask[start : start + step] = (
+            (constraints.gc_min <= content)
+            & (content <= constraints.gc_max)
+            & (longest <= constraints.max_run_length)
+            & ~reserved
+        )
+
+    return mask.reshape(len(states), 2**reserved_size, 2**input_size)
+
+
+# GC count, longest run and whether a reserved pattern occurs for every state
+# followed by every output symbol, indexed [state, output].
+def concatenations(
+    output_size: int, constraints: Constraints, states: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # With an odd output size one base is split between the state and the output,
+    # so the summaries cannot be joined and each concatenation is scanned whole.
+    if output_size % 2 == 1:
+        constraints.check_reserved_length(output_size)
+        outputs = np.arange(2**output_size, dtype=np.int64)
+        sequences = (states[:, None] << output_size) | outputs
+        whole = Summary(sequences, output_size)
+        _, found = constraints.matcher.run(sequences, output_size)
+        return whole.gc, whole.longest, found
+
+    # Symbols are output_size bits, so a state and an output are output_size bases.
+    half = output_size // 2
+    outputs, automaton, hits = output_summaries(output_size, constraints)
+    prefix = Summary(states, half)
+    after, found = automaton.run(states, half)
+
+    gc = prefix.gc[:, None] + outputs.gc
+    joined = np.where(
+        prefix.last[:, None] == outputs.first, prefix.trail[:, None] + outputs.lead, 0
+    )
+    longest = np.maximum(np.maximum(prefix.longest[:, None], outputs.longest), joined)
+    return gc, longest, found[:, None] | hits[after]
+
+
+# Whether table_from_constraints can build a table with the given sizes, that is
+# whether every state and input has at least one allowed choice of reserved bits.
+def feasible(symbol_size: int, reserved_bits: int, constraints: Constraints) -> bool:
+    output_size = 2 * symbol_size
+    mask = feasibility_mask(output_size - reserved_bits, output_size, constraints)
+    return bool(mask.any(axis=1).all())
+
+
+# Tightest GC window centred on 0.5 for which a table can be built with the given
+# sizes, keeping the other constraints. Every state and input needs some choice
+# of reserved bits within the window, so the window has to reach the worst of
+# their best choices, which is found directly rather than by rebuilding tables.
+def tightest_gc_window(
+    symbol_size: int, reserved_bits: int, constraints: Constraints
+) -> tuple[float, float]:
+    output_size = 2 * symbol_size
+
+    def distance(gc, longest, reserved):
+        # Twice the distance of the GC count from half the bases.
+        allowed = (longest <= constraints.max_run_length) & ~reserved
+        return np.where(allowed, np.abs(2 * gc - output_size), 2 * output_size + 1)
+
+    worst = worst_best(symbol_size, reserved_bits, constraints, distance)
+    if worst > output_size:
+        raise Exception("Impossible to meet constraints")
+
+    # Both ends are counts of GC bases over the length, as in gc_content.
+    count = (output_size - worst) // 2
+    return count / output_size, (output_size - count) / output_size
+
+
+# Shortest maximum run length for which a table can be built with the given
+# sizes, keeping the other constraints, found as in tightest_gc_window.
+def shortest_run_length(
+    symbol_size: int, reserved_bits: int, constraints: Constraints
+) -> int:
+    output_size = 2 * symbol_size
+
+    def run(gc, longest, reserved):
+        content = gc / output_size
+        allowed = (
+            (constraints.gc_min <= content) & (content <= constraints.gc_max) & ~reserved
+        )
+        return np.where(allowed, longest, output_size + 1)
+
+    worst = worst_best(symbol_size, reserved_bits, constraints, run)
+    if worst > output_size:
+        raise Exception("Impossible to meet constraints")
+    return int(worst)
+
+
+# The largest over every state and input of the smallest cost of any choice of
+# reserved bits, where cost maps the GC counts, longest runs and reserved hits of
+# the concatenations to a cost each.
+def worst_best(
+    symbol_size: int, reserved_bits: int, constraints: Constraints, cost: callable
+) -> int:
+    output_size = 2 * symbol_size
+    if reserved_bits >= output_size:
+        raise Exception("Too many reserved bits for given symbol size.")
+
+    states = np.arange(2**output_size)
+    step = max(1, CHUNK_SIZE // 2**output_size)
+    worst = 0
+
+    for start in range(0, len(states), step):
+        chunk = states[start : start + step]
+        costs = cost(*concatenations(output_size, constraints, chunk))
+        costs = costs.reshape(len(chunk), 2**reserved_bits, -1)
+        worst = max(worst, int(costs.min(axis=1).max()))
+
+    return worst
+
+
+# Summaries of every output symbol, the automaton for the reserved patterns and
+# hits[state, output], whether reading the output from that automaton state hits
+# a pattern. Built once per output size and set of constraints.
+def output_summaries(
+    output_size: int, constraints: Constraints
+) -> tuple[Summary, Automaton, np.ndarray]:
+    key = (output_size, repr(constraints))
+    if key in _outputs:
+        return _outputs[key]
+
+    constraints.check_reserved_length(output_size)
+    automaton = constraints.matcher
+
+    half = output_size // 2
+    symbols = np.arange(2**output_size, dtype=np.int64)
+    starts = np.arange(automaton.num_states)[:, None]
+    _, hits = automaton.run(symbols, half, starts)
+
+    if len(_outputs) >= SUMMARY_CACHE_SIZE:
+        del _outputs[next(iter(_outputs))]
+    _outputs[key] = (Summary(symbols, half), automaton, hits)
+    return _outputs[key]
+
+
+# Vectorised Constraints.satisfied over integer-encoded DNA sequences of the
+# given number of bases.
+def satisfied(sequences: np.ndarray, length: int, constraints: Constraints) -> np.ndarray:
+    summary = Summary(sequences, length)
+    content = summary.gc / length
+    ok = (
+        (constraints.gc_min <= content)
+        & (content <= constraints.gc_max)
+        & (summary.longest <= constraints.max_run_length)
+    )
+    constraints.check_reserved_length(length)
+    _, found = constraints.matcher.run(sequences, length)
+    return ok & ~found
@@ -1,18 +1,109 @@
 import math
+import numpy as np
+import random as rn
 from constraints import Constraints
 from data_types import Path, Transition
-from dna_mapping import bits_to_dna
-from utils import hamming_dist, table_from_list
+from feasibility import CHUNK_SIZE, feasibility_mask, satisfied
+from trellis import (
+    Trellis,
+    acs_viterbi,
+    acs_viterbi_batch,
+    bits_to_symbols,
+    compile_table,
+    symbols_to_bits,
+)
+from utils import table_from_list
+
+
+# Available Viterbi decoders. "paths" is the original decoder which copies every
+# survivor path at every step and is kept as a reference for the others.
+DECODERS = ["traceback", "numpy", "windowed", "pruned", "paths"]
+
+# Rough number of trellis edges times reads handled per step by the batch decoder,
+# beyond which working arrays stop fitting in cache and batching stops paying off.
+BATCH_EDGES = 2**18
+
+# Added to the metric of a branch which breaks the constraints in constraint_viterbi.
+CONSTRAINT_PENALTY = 1000
+
+# Number of survivors kept at each step by the pruned decoder by default.
+BEAM_WIDTH = 64
+
+# Number of symbols decoded either side of a corrupted symbol by the windowed decoder.
+WINDOW_MARGIN = 6
 
 
 class FSM:
     def __init__(
-        self, init_state: str, transition_table, input_size: int, output_size: int
+        self,
+        init_state: str,
+        transition_table,
+        input_size: int,
+        output_size: int,
+        decoder: str = "traceback",
     ):
+        if decoder not in DECODERS:
+            raise Exception(f"Unknown decoder {decoder}, expected one of {DECODERS}.")
+
         self.init_state = init_state
-        self.table = transition_table
+        self._table = transition_table
         self.input_size = input_size
         self.output_size = output_size
+        self.decoder = decoder
+        self._trellis = None
+        self._penalties = {}
+
+        # Settings for the pruned decoder, and how often it has been checked
+        # against exact decoding and found a different path.
+        self.beam = BEAM_WIDTH
+        self.threshold = None
+        self.pruning_checks = 0
+        self.pruning_changes = 0
+
+    # An FSM around an already compiled trellis, such as one loaded from the FSM
+    # cache. The dict table is only rebuilt if something asks for it.
+    @classmethod
+    def from_trellis(cls, trellis: Trellis, decoder: str = "traceback") -> "FSM":
+        fsm = cls(
+            trellis.states[trellis.init_state],
+            None,
+            trellis.input_size,
+            trellis.output_size,
+            decoder,
+        )
+        fsm._trellis = trellis
+        return fsm
+
+    # Publishes the compiled table into a new shared memory block, which worker
+    # processes open with FSM.attach(block.name). The caller must close and unlink
+    # the returned block once the workers are done.
+    def publish(self, name: str = None):
+        from shared_fsm import publish
+
+        return publish(self.trellis, name)
+
+    @classmethod
+    def attach(
+        cls, name: str, decoder: str = "traceback", tracked: bool = None
+    ) -> "FSM":
+        from shared_fsm import attach
+
+        return cls.from_trellis(attach(name, tracked), decoder)
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = self.trellis.to_table()
+        return self._table
+
+    # The integer-indexed form of the transition table, compiled on first use.
+    @property
+    def trellis(self) -> Trellis:
+        if self._trellis is None:
+            self._trellis = compile_table(
+                self.table, self.init_state, self.input_size, self.output_size
+            )
+        return self._trellis
 
     def conv(self, message: str) -> str:
         if len(message) % self.input_size != 0:
@@ -20,35 +111,80 @@ class FSM:
                 "The length of the input message must be a multiple of the input size."
             )
 
-        result = ""
-        state = self.init_state
+        trellis = self.trellis
+        inputs = bits_to_symbols(message, self.input_size).tolist()
+        next_state = trellis.next_state.tolist()
+        output = trellis.output.tolist()
+
+        outputs = []
+        state = trellis.init_state
 
-        for i in range(0, len(message), self.input_size):
-            symbol = message[i : i + self.input_size]
-            new = self.table[state][symbol]
+        for symbol in inputs:
+            if next_state[state][symbol] < 0:
+                raise Exception(
+                    f"Invalid input {trellis.input_label(symbol)} has no transition in table."
+                )
 
-            if new is None:
-                raise Exception(f"Invalid input {symbol} has no transition in table.")
+            outputs.append(output[state][symbol])
+            state = next_state[state][symbol]
 
-            state = new.next
-            result += new.output
+        return symbols_to_bits(outputs, self.output_size)
+
+    # Encodes many messages at once, stepping every message through the trellis
+    # together. Messages of different lengths are encoded in groups of equal length.
+    def conv_batch(self, messages: list[str]) -> list[str]:
+        trellis = self.trellis
+        results = [None] * len(messages)
+
+        for indices in group_by_length(messages):
+            inputs = np.stack(
+                [bits_to_symbols(messages[i], self.input_size) for i in indices]
+            )
+            outputs = np.empty(inputs.shape, dtype=np.int64)
+            state = np.full(len(indices), trellis.init_state)
 
-        return result
+            for t in range(inputs.shape[1]):
+                next = trellis.next_state[state, inputs[:, t]]
+                if np.any(next < 0):
+                    symbol = inputs[np.argmax(next < 0), t]
+                    raise Exception(
+                        f"Invalid input {trellis.input_label(symbol)} has no transition in table."
+                    )
+                outputs[:, t] = trellis.output[state, inputs[:, t]]
+                state = next
 
-    def viterbi(self, received: str) -> str:
+            for i, output in zip(indices, outputs):
+                results[i] = symbols_to_bits(output, self.output_size)
+
+        return results
+
+    def viterbi(self, received: str) -> Path:
+        if self.decoder == "paths":
+            return self.path_viterbi(received)
+        if self.decoder == "numpy":
+            return self.numpy_viterbi(received)
+        if self.decoder == "windowed":
+            return self.windowed_viterbi(received)
+        if self.decoder == "pruned":
+            return self.pruned_viterbi(received, self.beam, self.threshold)
+        return self.traceback_viterbi(received)
+
+    def path_viterbi(self, received: str) -> Path:
         if len(received) % self.output_size != 0:
             raise Exception(
                 "The length of the received message must be a multiple of the symbol size."
             )
 
+        branch_metrics = self.trellis.branch_metrics
         paths = {self.init_state: Path(self.init_state)}
 
         for i in range(0, len(received), self.output_size):
             symbol = received[i : i + self.output_size]
+            dists = branch_metrics[int(symbol, 2)]
             extended_paths = {}
             for path in paths.values():
                 for t in self.table[path.tip].values():
-                    dist = hamming_dist(symbol, t.output)
+                    dist = int(dists[int(t.output, 2)])
                     extended = path.copy()
                     extended.extend(t.next, dist, t.input, t.output)
 
@@ -70,6 +206,363 @@ class FSM:
         assert shortest is not None
         return shortest
 
+    # Keeps only the metric of the survivor ending in each state, along with a
+    # backpointer per state per symbol, as in survivor_steps.
+    #
+    # If beam or threshold are given, survivors are pruned after every step to the
+    # beam best, and to those within threshold of the best metric (M-algorithm).
+    # If a penalty table is given, CONSTRAINT_PENALTY is added to every branch
+    # whose output does not meet the constraints when following the previous one.
+    def traceback_viterbi(
+        self,
+        received: str,
+        beam: int = None,
+        threshold: int = None,
+        penalty: np.ndarray = None,
+    ) -> Path:
+        if len(received) % self.output_size != 0:
+            raise Exception(
+                "The length of the received message must be a multiple of the symbol size."
+            )
+
+        trellis = self.trellis
+        next_state = trellis.next_state.tolist()
+        output = trellis.output.tolist()
+
+        # Penalties of the branches out of each state after each last output.
+        costs = None
+        if penalty is not None:
+            row_costs = {}
+
+            def costs(last: int, tip: int) -> list[int]:
+                if (last, tip) not in row_costs:
+                    row = penalty[last, output[tip]] * CONSTRAINT_PENALTY
+                    row_costs[(last, tip)] = row.tolist()
+                return row_costs[(last, tip)]
+
+        steps = survivor_steps(
+            bits_to_symbols(received, self.output_size),
+            trellis.init_state,
+            trellis.num_inputs,
+            lambda state: (next_state[state], output[state]),
+            lambda symbol: trellis.branch_metrics[symbol].tolist(),
+            beam,
+            threshold,
+            costs,
+        )
+        return trace_path(trellis, steps, received)
+
+    # Viterbi decoding which penalises paths whose consecutive output symbols break
+    # the given constraints. The penalty table is built once per set of constraints.
+    def constraint_viterbi(self, received: str, constraints: Constraints) -> Path:
+        key = repr(constraints)
+        if key not in self._penalties:
+            self._penalties[key] = penalty_table(self.trellis, constraints)
+        return self.traceback_viterbi(received, penalty=self._penalties[key])
+
+    # Beam-pruned decoding for large tables, where full Viterbi touches every state
+    # at every step. With verify set, the exact path is also found and compared,
+    # counting how often pruning changed the result.
+    def pruned_viterbi(
+        self,
+        received: str,
+        beam: int = BEAM_WIDTH,
+        threshold: int = None,
+        verify: bool = False,
+    ) -> Path:
+        path = self.traceback_viterbi(received, beam, threshold)
+
+        if verify:
+            exact = self.numpy_viterbi(received)
+            self.pruning_checks += 1
+            if exact.observations != path.observations:
+                self.pruning_changes += 1
+
+        return path
+
+    # Fraction of verified pruned decodes which differed from exact decoding.
+    def pruning_change_rate(self) -> float:
+        if self.pruning_checks == 0:
+            return 0.0
+        return self.pruning_changes / self.pruning_checks
+
+    # Whole-array add-compare-select over every state at once, for large tables.
+    def numpy_viterbi(self, received: str) -> Path:
+        if len(received) % self.output_size != 0:
+            raise Exception(
+                "The length of the received message must be a multiple of the symbol size."
+            )
+
+        symbols = bits_to_symbols(received, self.output_size)
+        steps = acs_viterbi(self.trellis, symbols)
+        return trace_path(self.trellis, steps, received)
+
+    # Decodes many received messages at once, running the trellis across all reads
+    # of the same length together. Gives the same paths as numpy_viterbi per read.
+    def viterbi_batch(self, received: list[str], batch_size: int = 64) -> list[Path]:
+        trellis = self.trellis
+        paths = [None] * len(received)
+        edges = max(len(trellis.edges.state), 1)
+        batch_size = max(1, min(batch_size, BATCH_EDGES // edges))
+
+        for group in group_by_length(received):
+            if len(received[group[0]]) % self.output_size != 0:
+                raise Exception(
+                    "The length of the received message must be a multiple of the symbol size."
+                )
+
+            # Decoding in smaller batches also bounds the memory held in backpointers.
+            for b in range(0, len(group), batch_size):
+                indices = group[b : b + batch_size]
+                symbols = np.stack(
+                    [bits_to_symbols(received[i], self.output_size) for i in indices]
+                )
+                states, inputs, lengths = acs_viterbi_batch(trellis, symbols)
+                batch = batch_paths(trellis, symbols, states, inputs, lengths)
+                for i, path in zip(indices, batch):
+                    paths[i] = path
+
+        return paths
+
+    # When each output symbol determines the next state, as in tables built from
+    # constraints, a received symbol is consistent if it is a valid output from the
+    # state implied by the symbol before it. Only windows around inconsistent
+    # symbols are decoded with Viterbi and clean stretches are copied through. At
+    # low error rates this is far cheaper than decoding the whole message, but it
+    # is not guaranteed to find the same path as full Viterbi.
+    def windowed_viterbi(self, received: str, margin: int = WINDOW_MARGIN) -> Path:
+        if len(received) % self.output_size != 0:
+            raise Exception(
+                "The length of the received message must be a multiple of the symbol size."
+            )
+
+        trellis = self.trellis
+        symbols = bits_to_symbols(received, self.output_size)
+        next_of_output = trellis.next_of_output()
+
+        if next_of_output is None or len(symbols) == 0:
+            return self.numpy_viterbi(received)
+
+        # The state each symbol is sent from if the one before it was received intact.
+        states = np.empty(len(symbols), dtype=np.int64)
+        states[0] = trellis.init_state
+        states[1:] = next_of_output[symbols[:-1]]
+
+        matches = (trellis.output[states] == symbols[:, None]) & (
+            trellis.next_state[states] >= 0
+        )
+        matches[states < 0] = False
+        inputs = np.argmax(matches, axis=1)
+        steps = list(zip(states.tolist(), inputs.tolist()))
+
+        for start, end in corrupted_windows(~matches.any(axis=1), margin):
+            window = acs_viterbi(
+                trellis,
+                symbols[start:end],
+                start=states[start],
+                end=states[end] if end < len(symbols) else None,
+            )
+            if window is None:
+                # No path through the window rejoins the clean symbols after it,
+                # so everything from the window on is decoded together instead.
+                steps[start:] = acs_viterbi(trellis, symbols[start:], states[start])
+                break
+            steps[start:end] = window
+
+        return trace_path(trellis, steps, received)
+
+
+# Marks penalty[prev_output, output] for every pair of consecutive outputs the
+# trellis can produce whose DNA does not satisfy the constraints. Only pairs that
+# can follow each other are checked, other entries are left unset. The bits of a
+# pair are the integer prev_output << output_size | output, so every pair is
+# checked in one vectorised pass with the compiled reserved matcher.
+def penalty_table(trellis: Trellis, constraints: Constraints) -> np.ndarray:
+    size = 2**trellis.output_size
+    penalty = np.zeros((size, size), dtype=bool)
+    edges = trellis.edges
+
+    prev, state = np.unique(np.stack([edges.output, edges.next]), axis=1)
+    outputs = trellis.output[state]
+    prev = np.repeat(prev, outputs.shape[1])
+    outputs = outputs.ravel()
+    prev, outputs = prev[outputs >= 0], outputs[outputs >= 0]
+
+    windows = (prev.astype(np.int64) << trellis.output_size) | outputs
+    penalty[prev, outputs] = ~satisfied(windows, trellis.output_size, constraints)
+    return penalty
+
+
+# Add-compare-select over a dict of survivors, returning the (state, input) taken
+# at each step by the best path. row(state) gives the next states and outputs of
+# every input from a state, with a next state of -1 where there is none, and
+# distances(symbol) the distance of every output from a received symbol. Only the
+# rows of surviving states are looked up, so they can be built as they are
+# reached. Survivors are pruned after every step as in prune, and costs(last,
+# state), if given, is added to the branches out of a state whose survivor's
+# last output was last. The winning path is rebuilt with a single traceback at
+# the end rather than copying every survivor at every step.
+def survivor_steps(
+    symbols: np.ndarray,
+    init_state: int,
+    num_inputs: int,
+    row: callable,
+    distances: callable,
+    beam: int = None,
+    threshold: int = None,
+    costs: callable = None,
+) -> list[tuple[int, int]]:
+    metrics = {init_state: 0}
+    backpointers = []
+
+    # Last output of the survivor ending in each state.
+    last = {}
+    no_costs = [0] * num_inputs
+
+    for symbol in symbols:
+        dists = distances(symbol)
+        extended = {}
+        pointers = {}
+        outputs = {}
+        for tip, length in metrics.items():
+            next_states, output = row(tip)
+            extra = no_costs
+            if costs is not None and tip in last:
+                extra = costs(last[tip], tip)
+
+            for i in range(num_inputs):
+                next = next_states[i]
+                if next < 0:
+                    continue
+
+                dist = length + dists[output[i]] + extra[i]
+
+                if next not in extended or dist < extended[next]:
+                    extended[next] = dist
+                    pointers[next] = tip * num_inputs + i
+                    outputs[next] = output[i]
+
+        metrics = prune(extended, beam, threshold)
+        backpointers.append(pointers)
+        last = outputs
+
+    # min() returns the first of any equal metrics, matching the reference decoder.
+    state = min(metrics, key=metrics.get)
+    steps = []
+    for pointers in reversed(backpointers):
+        state, input = divmod(pointers[state], num_inputs)
+        steps.append((state, input))
+    steps.reverse()
+    return steps
+
+
+# Keeps the survivors with the beam lowest metrics and those within threshold of
+# the lowest, in the order they were first reached.
+def prune(metrics: dict[int, int], beam: int = None, threshold: int = None):
+    if threshold is not None:
+        best = min(metrics.values())
+        metrics = {s: m for s, m in metrics.items() if m <= best + threshold}
+
+    if beam is not None and len(metrics) > beam:
+        # sorted() is stable, so ties are kept in the order they were reached.
+        kept = set(sorted(metrics, key=metrics.get)[:beam])
+        metrics = {s: m for s, m in metrics.items() if s in kept}
+
+    return metrics
+
+
+# Indices of the given strings grouped by length, in order of first appearance.
+def group_by_length(strings: list[str]) -> list[list[int]]:
+    groups = {}
+    for i, s in enumerate(strings):
+        groups.setdefault(len(s), []).append(i)
+    return list(groups.values())
+
+
+# Merges the windows of the given margin around each corrupted position.
+def corrupted_windows(corrupted: np.ndarray, margin: int) -> list[tuple[int, int]]:
+    windows = []
+    for i in np.nonzero(corrupted)[0].tolist():
+        start = max(i - margin, 0)
+        end = min(i + margin + 1, len(corrupted))
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], end)
+        else:
+            windows.append((start, end))
+    return windows
+
+
+# Paths of a batch of reads from the states and inputs taken at each step and
+# the metric of each read's best path, as returned by acs_viterbi_batch, with
+# the distances of every step looked up at once.
+def batch_paths(
+    trellis: Trellis,
+    symbols: np.ndarray,
+    states: np.ndarray,
+    inputs: np.ndarray,
+    lengths: np.ndarray,
+) -> list[Path]:
+    next_states = trellis.next_state[states, inputs]
+    outputs = trellis.output[states, inputs]
+    distances = trellis.branch_metrics[symbols, outputs]
+
+    paths = []
+    for r in range(len(symbols)):
+        path = Path(trellis.states[trellis.init_state])
+        path.visited.extend(trellis.states[n] for n in next_states[r].tolist())
+        path.distances.extend(distances[r].tolist())
+        path.tip = path.visited[-1]
+        path.length = int(lengths[r])
+        path.sequence = symbols_to_bits(inputs[r], trellis.input_size)
+        path.observations = symbols_to_bits(outputs[r], trellis.output_size)
+        paths.append(path)
+    return paths
+
+
+# Rebuilds a Path from the (state, input) pair taken at each step of a trellis.
+def trace_path(trellis: Trellis, steps: list[tuple[int, int]], received: str) -> Path:
+    return build_path(
+        trellis.states[trellis.init_state],
+        steps,
+        received,
+        trellis.input_size,
+        trellis.output_size,
+        lambda state, input: (
+            trellis.states[trellis.next_state[state, input]],
+            int(trellis.output[state, input]),
+        ),
+    )
+
+
+# Rebuilds a Path from the (state, input) pair taken at each step, where
+# step(state, input) gives the label of the next state and the output taken.
+def build_path(
+    init_state: str,
+    steps: list[tuple[int, int]],
+    received: str,
+    input_size: int,
+    output_size: int,
+    step: callable,
+) -> Path:
+    path = Path(init_state)
+    symbols = bits_to_symbols(received, output_size).tolist()
+    inputs = []
+    outputs = []
+
+    for (state, input), symbol in zip(steps, symbols):
+        next, output = step(state, input)
+        dist = bin(output ^ symbol).count("1")
+        path.tip = next
+        path.length += dist
+        path.visited.append(next)
+        path.distances.append(dist)
+        inputs.append(format(input, f"0{input_size}b"))
+        outputs.append(format(output, f"0{output_size}b"))
+
+    path.sequence = "".join(inputs)
+    path.observations = "".join(outputs)
+    return path
+
 
 def populate_space(size: int) -> list[str]:
     space = []
@@ -86,30 +579,64 @@ def table_from_constraints(
     output_size: int,
     constraints: Constraints,
     choice_mechanism: callable,
+    seed=None,
 ):
     if input_size >= output_size:
         raise Exception("Input/trigger size must be less than the output/symbol size.")
 
+    transitions = constraint_rows(
+        input_size, output_size, constraints, choice_mechanism, 0, 2**output_size, seed
+    )
+    return table_from_list(transitions)
+
+
+# Transitions out of the states numbered start to stop of the table built by
+# table_from_constraints. If a seed is given, the random module is reseeded from
+# it and the state before each state's choices, so that every state draws from
+# its own stream and rows can be built in any order or process with the same
+# result. The global random state is restored afterwards.
+def constraint_rows(
+    input_size: int,
+    output_size: int,
+    constraints: Constraints,
+    choice_mechanism: callable,
+    start: int,
+    stop: int,
+    seed=None,
+) -> list[Transition]:
     transitions = []
 
     reserved_size = output_size - input_size
-    states = populate_space(output_size)  # Horizontal Symbols
     inputs = populate_space(input_size)  # Vertical Symbols
     reserved = populate_space(reserved_size)  # Reserved bits
+    saved = rn.getstate()
 
-    for s in states:
-        for i in inputs:
-            candidates = []
-            for r in reserved:
-                if constraints.satisfied(bits_to_dna(s + r + i)):
-                    candidates.append(r)
-            if len(candidates) == 0:
-                raise Exception("Impossible to meet constraints")
-            chosen = choice_mechanism(s, i, candidates)
-            output = chosen + i
-            transitions.append(Transition(start=s, input=i, output=output, next=output))
+    # Constraints are checked for a block of states at a time with one vectorised
+    # pass, giving ok[state, reserved, input] for every concatenation s + r + i.
+    step = max(1, CHUNK_SIZE // 2**output_size)
 
-    return table_from_list(transitions)
+    for first in range(start, stop, step):
+        last = min(first + step, stop)
+        block = [format(k, f"0{output_size}b") for k in range(first, last)]
+        ok = feasibility_mask(
+            input_size, output_size, constraints, np.arange(first, first + len(block))
+        )
+        for s, feasible in zip(block, ok):
+            if seed is not None:
+                rn.seed(f"{seed}:{s}")
+            for i, allowed in zip(inputs, feasible.T):
+                candidates = [reserved[r] for r in np.flatnonzero(allowed)]
+                if len(candidates) == 0:
+                    raise Exception("Impossible to meet constraints")
+                chosen = choice_mechanism(s, i, candidates)
+                output = chosen + i
+                transitions.append(
+                    Transition(start=s, input=i, output=output, next=output)
+                )
+
+    if seed is not None:
+        rn.setstate(saved)
+    return transitions
 
 
 def construct_fsm_from_constraints(
@@ -118,8 +645,9 @@ def construct_fsm_from_constraints(
     output_size: int,
     constraints: Constraints,
     choice_mechanism: callable,
+    seed=None,
 ) -> FSM:
     table = table_from_constraints(
-        input_size, output_size, constraints, choice_mechanism
+        input_size, output_size, constraints, choice_mechanism, seed
     )
     return FSM(init_state, table, input_size, output_size)
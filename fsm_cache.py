@@ -0,0 +1,292 @@
+import hashlib
+import json
+import os
+import random as rn
+import numpy as np
+from collections import OrderedDict
+from choice_mechanism import gc_tracking
+from constraints import Constraints
+from data_types import Transition
+from fsm import FSM, construct_fsm_from_constraints
+from trellis import Trellis, compile_table
+from utils import table_from_list
+
+# Bumped whenever table construction changes in a way that changes the tables it
+# builds, so that stale cache entries are never loaded.
+CACHE_VERSION = 1
+
+# Rust mechanisms whose tables depend on earlier builds in the same process, as
+# random_unused remembers the reserved bits it has used across every build.
+UNCACHEABLE = ["random_unused"]
+
+# Mechanisms which make no random choices, so that their tables are the same
+# for every seed and are cached once for all of them.
+SEED_INDEPENDENT = [gc_tracking]
+SEED_INDEPENDENT_RUST = ["gc_tracking"]
+
+# Number of FSMs kept in memory by default.
+MEMORY_CACHE_SIZE = 16
+
+# Number of FSMs kept on disk, least recently used first to go.
+DISK_CACHE_SIZE = int(os.environ.get("FSM_CACHE_SIZE", 256))
+
+# Where cached FSMs are stored, one .npz file per configuration.
+CACHE_DIR = os.environ.get(
+    "FSM_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".fsm_cache"),
+)
+
+
+# Stable hash of everything that determines a constructed table. Floats are
+# converted so that NumPy scalars and Python floats give the same key.
+def cache_key(
+    kind: str, mechanism: str, sizes: tuple, constraints: Constraints, seed
+) -> str:
+    parts = {
+        "version": CACHE_VERSION,
+        "kind": kind,
+        "mechanism": mechanism,
+        "sizes": list(sizes),
+        "gc": [float(constraints.gc_min), float(constraints.gc_max)],
+        "str": [int(constraints.str_lower), int(constraints.str_upper)],
+        "run": int(constraints.max_run_length),
+        "reserved": list(constraints.reserved),
+        "seed": seed,
+    }
+    text = json.dumps(parts, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def load(key: str, directory: str = CACHE_DIR):
+    path = os.path.join(directory, key + ".npz")
+    if not os.path.exists(path):
+        return None, None
+    # Marks the entry as recently used for prune.
+    os.utime(path)
+
+    with np.load(path, allow_pickle=False) as data:
+        trellis = Trellis(
+            data["states"].tolist(),
+            int(data["init_state"]),
+            data["next_state"],
+            data["output"],
+            int(data["input_size"]),
+            int(data["output_size"]),
+        )
+        rng = data["rng"] if "rng" in data else None
+    return trellis, rng
+
+
+# Writes to a temporary file first so that concurrent runs never see half a file.
+def store(
+    key: str, trellis: Trellis, rng: np.ndarray = None, directory: str = CACHE_DIR
+):
+    os.makedirs(directory, exist_ok=True)
+    arrays = {
+        "states": np.array(trellis.states),
+        "init_state": np.array(trellis.init_state),
+        "next_state": trellis.next_state,
+        "output": trellis.output,
+        "input_size": np.array(trellis.input_size),
+        "output_size": np.array(trellis.output_size),
+    }
+    if rng is not None:
+        arrays["rng"] = rng
+
+    path = os.path.join(directory, key + ".npz")
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(temp, path)
+    prune(directory)
+
+
+# Deletes the least recently used entries beyond the given number. Entries
+# another process has already removed are skipped.
+def prune(directory: str = CACHE_DIR, size: int = DISK_CACHE_SIZE):
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith(".npz"):
+            path = os.path.join(directory, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                pass
+
+    entries.sort()
+    for _, path in entries[: max(len(entries) - size, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# The state of the global random module as a flat array, with the cached normal
+# deviate last (NaN if there is none). Every word fits exactly in a float64.
+def save_rng() -> np.ndarray:
+    _, internal, gauss = rn.getstate()
+    return np.array(list(internal) + [np.nan if gauss is None else gauss])
+
+
+def restore_rng(saved: np.ndarray):
+    internal = tuple(int(x) for x in saved[:-1])
+    gauss = None if np.isnan(saved[-1]) else float(saved[-1])
+    rn.setstate((3, internal, gauss))
+
+
+# Least recently used store of constructed FSMs within one process, in front
+# of the on-disk cache, counting how often lookups are found.
+class FSMCache:
+    def __init__(self, maxsize: int = MEMORY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key: str, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self.resize(self.maxsize)
+        return value
+
+    def resize(self, maxsize: int):
+        self.maxsize = maxsize
+        while len(self.entries) > max(maxsize, 0):
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+memory = FSMCache()
+
+
+# Drop-in for construct_fsm_from_constraints which reuses the FSM when the same
+# configuration has been built before in this process, or loads it from disk
+# unless directory is None. Mechanisms which use randomness are built after
+# seeding the global random module with the given seed, which is part of the
+# key, and leave it as building would have, so seeded experiments give the same
+# results with or without the cache. Without a seed they are never cached, as
+# no later run could reproduce the table.
+def cached_fsm(
+    init_state: str,
+    input_size: int,
+    output_size: int,
+    constraints: Constraints,
+    choice_mechanism: callable,
+    seed: int = None,
+    directory: str = CACHE_DIR,
+) -> FSM:
+    name = f"{choice_mechanism.__module__}.{choice_mechanism.__qualname__}"
+    random = choice_mechanism not in SEED_INDEPENDENT
+    # Lambdas and local functions cannot be told apart by name.
+    if "<" in name or (random and seed is None):
+        return construct_fsm_from_constraints(
+            init_state, input_size, output_size, constraints, choice_mechanism
+        )
+
+    key = cache_key(
+        "python",
+        name,
+        (init_state, input_size, output_size),
+        constraints,
+        seed if random else None,
+    )
+
+    entry = memory.get(key)
+    if entry is None:
+        trellis, rng = load(key, directory) if directory else (None, None)
+        if trellis is None:
+            if random:
+                rn.seed(seed)
+            fsm = construct_fsm_from_constraints(
+                init_state, input_size, output_size, constraints, choice_mechanism
+            )
+            trellis, rng = fsm.trellis, save_rng() if random else None
+            if directory:
+                store(key, trellis, rng, directory)
+        entry = memory.put(key, (trellis, rng))
+
+    trellis, rng = entry
+    if rng is not None:
+        restore_rng(rng)
+    return FSM.from_trellis(trellis)
+
+
+# Rust FSMs are tuples of (input_size, output_size, init_state, table) where the
+# table maps state -> input -> (next, output).
+def trellis_from_rust(fsm) -> Trellis:
+    input_size, output_size, init_state, table = fsm
+    transitions = []
+    for state in sorted(table):
+        for input in sorted(table[state]):
+            next, output = table[state][input]
+            transitions.append(Transition(state, next, input, output))
+    return compile_table(
+        table_from_list(transitions), init_state, input_size, output_size
+    )
+
+
+def trellis_to_rust(trellis: Trellis):
+    next_state = trellis.next_state.tolist()
+    output = trellis.output.tolist()
+    table = {}
+    for s, state in enumerate(trellis.states):
+        row = {}
+        for i in range(trellis.num_inputs):
+            if next_state[s][i] >= 0:
+                row[trellis.input_label(i)] = (
+                    trellis.states[next_state[s][i]],
+                    trellis.output_label(output[s][i]),
+                )
+        table[state] = row
+    return (
+        trellis.input_size,
+        trellis.output_size,
+        trellis.states[trellis.init_state],
+        table,
+    )
+
+
+# Cached form of the Rust *_fsm builders, where build() constructs the FSM on a
+# miss. The Rust mechanisms seed their own generator, so the seed is the key, and
+# without one they are not cached.
+def cached_rust_fsm(
+    mechanism: str,
+    symbol_size: int,
+    reserved_bits: int,
+    init_state: str,
+    constraints: Constraints,
+    seed: int,
+    build: callable,
+    directory: str = CACHE_DIR,
+):
+    if mechanism in SEED_INDEPENDENT_RUST:
+        seed = None
+    elif mechanism in UNCACHEABLE or seed is None:
+        return build()
+    key = cache_key(
+        "rust", mechanism, (init_state, symbol_size, reserved_bits), constraints, seed
+    )
+
+    fsm = memory.get(key)
+    if fsm is None:
+        trellis, _ = load(key, directory) if directory else (None, None)
+        if trellis is not None:
+            fsm = trellis_to_rust(trellis)
+        else:
+            fsm = build()
+            if directory:
+                store(key, trellis_from_rust(fsm), directory=directory)
+        memory.put(key, fsm)
+    return fsm
@@ -0,0 +1,83 @@
+import numpy as np
+from dataclasses import dataclass
+
+# Maps the bytes of a DNA string to base numbers as in dna_mapping, and anything
+# else to 4.
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for i, base in enumerate(b"ACGT"):
+    BASE_CODES[base] = i
+
+
+# Windowed GC content of a sequence for one window size. Spread is the largest
+# difference between two windows, as returned by utils.max_gc_variance.
+@dataclass
+class WindowStats:
+    window: int
+    min: float
+    max: float
+    mean: float
+    variance: float
+
+    @property
+    def spread(self) -> float:
+        return self.max - self.min
+
+
+# Base numbers of a DNA string, or the given array of them unchanged.
+def base_codes(sequence) -> np.ndarray:
+    if isinstance(sequence, str):
+        return BASE_CODES[np.frombuffer(sequence.encode(), dtype=np.uint8)]
+    return np.asarray(sequence, dtype=np.uint8)
+
+
+# Number of G and C bases before each position, with one more entry for the
+# whole sequence, so the GC count of any window is a single subtraction.
+def gc_sums(sequence) -> np.ndarray:
+    codes = base_codes(sequence)
+    return np.concatenate(([0], np.cumsum((codes == 1) | (codes == 2))))
+
+
+# GC content of the windows of the given size starting at each of starts, taken
+# from prefix sums. Windows running past the end are cut short. Each window is
+# divided by its number of bases, or by its share of counts if given, a prefix
+# sum of the bases that should be counted.
+def window_gc(
+    sums: np.ndarray, window: int, starts: np.ndarray, counts: np.ndarray = None
+) -> np.ndarray:
+    if len(sums) < 2:
+        raise Exception("GC content of an empty sequence is undefined.")
+    if window > len(sums) - 1:
+        raise Exception("GC window is longer than the sequence.")
+
+    ends = np.minimum(starts + window, len(sums) - 1)
+    if counts is None:
+        return (sums[ends] - sums[starts]) / (ends - starts)
+    return (sums[ends] - sums[starts]) / (counts[ends] - counts[starts])
+
+
+# GC content of every window of the given size, one per step bases, for plotting
+# along the sequence.
+def gc_profile(sequence, window: int, step: int = 1) -> np.ndarray:
+    sums = gc_sums(sequence)
+    starts = np.arange(0, len(sums) - window, step)
+    return window_gc(sums, window, starts)
+
+
+# Statistics of the windowed GC content for each of the given window sizes, all
+# from a single prefix sum over the sequence.
+def gc_window_stats(
+    sequence, windows: list[int], step: int = 1
+) -> dict[int, WindowStats]:
+    sums = gc_sums(sequence)
+    stats = {}
+    for window in windows:
+        starts = np.arange(0, len(sums) - window, step)
+        profile = window_gc(sums, window, starts)
+        stats[window] = WindowStats(
+            window,
+            float(profile.min()),
+            float(profile.max()),
+            float(profile.mean()),
+            float(profile.var()),
+        )
+    return stats
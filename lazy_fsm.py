@@ -0,0 +1,118 @@
+import numpy as np
+from collections import OrderedDict
+from constraints import Constraints
+from data_types import Path
+from fsm import BEAM_WIDTH, build_path, constraint_rows, survivor_steps
+from trellis import bits_to_symbols, popcount, symbols_to_bits
+
+# Default number of table rows kept in memory by a lazy FSM.
+ROW_CACHE_SIZE = 4096
+
+
+# FSM built from constraints whose table rows are only worked out the first time
+# a state is reached, for symbol sizes whose full table does not fit in memory.
+# Each state draws its choices from its own random stream derived from the seed,
+# so every row is the same as in table_from_constraints with that seed however
+# the states are visited. States are numbered by the integer value of their bits,
+# and as in any table built from constraints the next state is the output.
+class LazyFSM:
+    def __init__(
+        self,
+        init_state: str,
+        input_size: int,
+        output_size: int,
+        constraints: Constraints,
+        choice_mechanism: callable,
+        seed=0,
+        max_rows: int = ROW_CACHE_SIZE,
+    ):
+        if input_size >= output_size:
+            raise Exception(
+                "Input/trigger size must be less than the output/symbol size."
+            )
+
+        self.init_state = init_state
+        self.input_size = input_size
+        self.output_size = output_size
+        self.constraints = constraints
+        self.choice_mechanism = choice_mechanism
+        self.seed = seed
+        self.max_rows = max_rows
+        self.rows = OrderedDict()
+        self.rows_built = 0
+
+        # Settings for decoding, as for the pruned decoder of FSM.
+        self.beam = BEAM_WIDTH
+        self.threshold = None
+
+    # Output of every input from the given state, built on first use and kept
+    # until it is the least recently used of more than max_rows rows.
+    def row(self, state: int) -> list[int]:
+        if state in self.rows:
+            self.rows.move_to_end(state)
+            return self.rows[state]
+
+        transitions = constraint_rows(
+            self.input_size,
+            self.output_size,
+            self.constraints,
+            self.choice_mechanism,
+            state,
+            state + 1,
+            self.seed,
+        )
+        row = [int(t.output, 2) for t in transitions]
+        self.rows_built += 1
+
+        self.rows[state] = row
+        if len(self.rows) > self.max_rows:
+            self.rows.popitem(last=False)
+        return row
+
+    def conv(self, message: str) -> str:
+        if len(message) % self.input_size != 0:
+            raise Exception(
+                "The length of the input message must be a multiple of the input size."
+            )
+
+        outputs = []
+        state = int(self.init_state, 2)
+        for symbol in bits_to_symbols(message, self.input_size).tolist():
+            state = self.row(state)[symbol]
+            outputs.append(state)
+
+        return symbols_to_bits(outputs, self.output_size)
+
+    # Beam-pruned Viterbi as in FSM.pruned_viterbi, with the beam and threshold
+    # set on the FSM, which only ever needs the rows of the surviving states.
+    # Without a beam or threshold every state is visited and the whole table ends
+    # up being built.
+    def viterbi(self, received: str) -> Path:
+        if len(received) % self.output_size != 0:
+            raise Exception(
+                "The length of the received message must be a multiple of the symbol size."
+            )
+
+        outputs = np.arange(2**self.output_size, dtype=np.uint32)
+
+        # The next state is the output.
+        def row(state: int) -> tuple[list[int], list[int]]:
+            next_states = self.row(state)
+            return next_states, next_states
+
+        def step(state: int, input: int) -> tuple[str, int]:
+            next = self.row(state)[input]
+            return format(next, f"0{self.output_size}b"), next
+
+        steps = survivor_steps(
+            bits_to_symbols(received, self.output_size),
+            int(self.init_state, 2),
+            2**self.input_size,
+            row,
+            lambda symbol: popcount(outputs ^ np.uint32(symbol)).tolist(),
+            self.beam,
+            self.threshold,
+        )
+        return build_path(
+            self.init_state, steps, received, self.input_size, self.output_size, step
+        )
@@ -0,0 +1,91 @@
+import numpy as np
+from dataclasses import dataclass
+from gc_profile import base_codes
+
+
+# Errors in one repetition of an experiment: differences between the encoded DNA
+# and the DNA received and corrected, between the encoded string and the string
+# received and observed by Viterbi, and between the sequence and its decoding.
+# Burst scores are as in utils.burst_score and the confusion matrix counts each
+# encoded base against its corrected base, as in utils.confusion.
+@dataclass
+class Errors:
+    dna_injected: int
+    dna_remaining: int
+    bits_injected: int
+    bits_remaining: int
+    sequence: int
+    burst_injected: int
+    burst_remaining: int
+    confusion: np.ndarray
+
+
+def as_bytes(sequence: str) -> np.ndarray:
+    return np.frombuffer(sequence.encode(), dtype=np.uint8)
+
+
+# Whether each pair of characters differs.
+def mismatches(one: str, two: str) -> np.ndarray:
+    if len(one) != len(two):
+        raise Exception("Sequences must be the same length.")
+    return as_bytes(one) != as_bytes(two)
+
+
+# Number of differences in each pair of equal length strings, from one
+# comparison over all of them.
+def hamming_dists(pairs: list[tuple[str, str]]) -> np.ndarray:
+    for one, two in pairs:
+        if len(one) != len(two):
+            raise Exception("Sequences must be the same length.")
+
+    lengths = [len(one) for one, _ in pairs]
+    different = as_bytes("".join(one for one, _ in pairs)) != as_bytes(
+        "".join(two for _, two in pairs)
+    )
+    groups = np.repeat(np.arange(len(pairs)), lengths)
+    return np.bincount(groups[different], minlength=len(pairs))
+
+
+# Every mismatch in a burst of two or more scores one, and lone mismatches score
+# nothing, which is the same as utils.burst_score.
+def burst_score(true: str, pred: str) -> int:
+    wrong = mismatches(true, pred)
+    before = np.concatenate(([False], wrong[:-1]))
+    after = np.concatenate((wrong[1:], [False]))
+    return int(wrong.sum() - (wrong & ~before & ~after).sum())
+
+
+def confusion(true: str, pred: str) -> np.ndarray:
+    if len(true) != len(pred):
+        raise Exception("Sequences must be the same length.")
+
+    t = base_codes(true)
+    p = base_codes(pred)
+    invalid = np.flatnonzero((t > 3) | (p > 3))
+    if len(invalid) > 0:
+        i = invalid[0]
+        raise Exception(f"Invalid base {true[i] if t[i] > 3 else pred[i]}.")
+
+    counts = np.bincount(4 * t.astype(np.int64) + p, minlength=16)
+    return counts.reshape(4, 4)
+
+
+def repetition_errors(
+    seq: str,
+    result: str,
+    enc: str,
+    err: str,
+    observed: str,
+    dna: str,
+    dna_err: str,
+    dna_cor: str,
+) -> Errors:
+    counts = hamming_dists(
+        [(dna, dna_err), (dna, dna_cor), (enc, err), (enc, observed), (seq, result)]
+    )
+    return Errors(
+        *(int(count) for count in counts),
+        burst_score(dna, dna_err),
+        burst_score(dna, dna_cor),
+        confusion(dna, dna_cor),
+    )
@@ -0,0 +1,139 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from constraints import Constraints
+from data_types import Path
+from fsm import FSM, constraint_rows, trace_path
+from shared_fsm import attach, publish
+from trellis import acs_viterbi, bits_to_symbols
+from utils import table_from_list
+
+# Default number of symbols whose decisions are kept from each block.
+BLOCK_SIZE = 512
+
+# Default number of extra symbols decoded either side of each block.
+OVERLAP = 64
+
+# Default number of states whose rows each task of the parallel table build covers.
+STATE_BLOCK = 256
+
+# Trellis used by each worker process, attached once when the worker starts.
+_trellis = None
+
+
+def _init_worker(name: str):
+    global _trellis
+    _trellis = attach(name, tracked=True)
+
+
+# Decodes symbols[lo:hi] and returns the steps for the block core starting at
+# offset start within it.
+def _decode_block(
+    symbols: np.ndarray, start: int, length: int, from_init: bool
+) -> list[tuple[int, int]]:
+    steps = acs_viterbi(_trellis, symbols, free_start=not from_init)
+    return steps[start : start + length]
+
+
+# Decodes a long received message by splitting it into blocks of block_size
+# symbols and decoding each in a process pool, padded with overlap symbols
+# either side. Blocks after the first start from every state at once, and only
+# the decisions for the block itself are kept, so stitching relies on survivor
+# paths having merged within the overlap.
+#
+# Whenever every survivor has merged with the whole-message best path within
+# overlap symbols of each block boundary, the result has the same path metric as
+# whole-message Viterbi and takes the same decisions, except where several paths
+# tie for the best metric. Blocks cannot see the order in which whole-message
+# decoding first reached each state, so they may pick a different one of the
+# tied paths. An overlap of several times the number of symbols a corrupted
+# symbol affects is usually enough; the default comfortably covers symbol sizes
+# up to 5 at the error rates in rustexps.py.
+def parallel_viterbi(
+    fsm: FSM,
+    received: str,
+    block_size: int = BLOCK_SIZE,
+    overlap: int = OVERLAP,
+    workers: int = None,
+) -> Path:
+    if len(received) % fsm.output_size != 0:
+        raise Exception(
+            "The length of the received message must be a multiple of the symbol size."
+        )
+
+    trellis = fsm.trellis
+    symbols = bits_to_symbols(received, fsm.output_size)
+
+    blocks = []
+    for start in range(0, len(symbols), block_size):
+        end = min(start + block_size, len(symbols))
+        lo = max(start - overlap, 0)
+        hi = min(end + overlap, len(symbols))
+        blocks.append((symbols[lo:hi], start - lo, end - start, lo == 0))
+
+    # Workers share the published table rather than each receiving a copy.
+    shared = publish(trellis)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(shared.name,)
+        ) as pool:
+            results = pool.map(_decode_block, *zip(*blocks))
+            steps = [step for block in results for step in block]
+    finally:
+        shared.close()
+        shared.unlink()
+
+    return trace_path(trellis, steps, received)
+
+
+# Builds the same table as table_from_constraints with the given seed, with the
+# rows for blocks of states_per_task states built in a process pool. Every state
+# draws its choices from its own random stream derived from the seed, so the
+# table does not depend on the number of workers or how states are split.
+def parallel_table_from_constraints(
+    input_size: int,
+    output_size: int,
+    constraints: Constraints,
+    choice_mechanism: callable,
+    seed,
+    workers: int = None,
+    states_per_task: int = STATE_BLOCK,
+):
+    if input_size >= output_size:
+        raise Exception("Input/trigger size must be less than the output/symbol size.")
+    if seed is None:
+        raise Exception("A seed is needed for the table not to depend on the workers.")
+
+    num_states = 2**output_size
+    starts = list(range(0, num_states, states_per_task))
+    stops = [min(start + states_per_task, num_states) for start in starts]
+    tasks = len(starts)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(
+            constraint_rows,
+            [input_size] * tasks,
+            [output_size] * tasks,
+            [constraints] * tasks,
+            [choice_mechanism] * tasks,
+            starts,
+            stops,
+            [seed] * tasks,
+        )
+        transitions = [t for rows in results for t in rows]
+
+    return table_from_list(transitions)
+
+
+def parallel_fsm_from_constraints(
+    init_state: str,
+    input_size: int,
+    output_size: int,
+    constraints: Constraints,
+    choice_mechanism: callable,
+    seed,
+    workers: int = None,
+) -> FSM:
+    table = parallel_table_from_constraints(
+        input_size, output_size, constraints, choice_mechanism, seed, workers
+    )
+    return FSM(init_state, table, input_size, output_size)
@@ -54,6 +54,40 @@ if __name__ == "__main__":
         )
         fsm_dur[1].append(fsm)
 
+    # Symbol sizes whose full tables are too large to build are profiled with
+    # lazily built tables, encoding and decoding a short sequence keeping
+    # lazy_beam survivors.
+    lazy_sizes = [7, 8]
+    lazy_beam = 16
+    lazy_dur = []
+
+    for length in lazy_sizes:
+        constraints = default_constraints(
+            symbol_size=length,
+            gc_min=0.0,
+            gc_max=1.0,
+            str_lower=length,
+            str_upper=length,
+            restriction_sites=[],
+            primers=[],
+        )
+
+        _, _, _, tot = pyprof(
+            Parameters(
+                symbol_size=length,
+                reserved_bits=length,
+                constraints=constraints,
+                sequence_length=60 * length,
+            ),
+            lazy=True,
+            beam=lazy_beam,
+        )
+        lazy_dur.append(tot)
+
+    print(f"LAZY SYMBOL SIZES : {lazy_sizes}")
+    print(f"LAZY BEAM WIDTH   : {lazy_beam}")
+    print(f"LAZY DURATION     : {lazy_dur}")
+
     labels = ["Native Python", "Rust Call"]
 
     multiplot(
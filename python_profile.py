@@ -3,12 +3,25 @@ from constraints import default_constraints
 from data_types import Path
 from dna_mapping import bits_to_dna, dna_to_bits
 from experiments import Parameters
-from fsm import construct_fsm_from_constraints
+from fsm import BEAM_WIDTH, construct_fsm_from_constraints
+from fsm_cache import cached_fsm
 from graphing import plot
+from lazy_fsm import LazyFSM
 from utils import inject_base_errors, rand_bit_string
 
 
-def profile(config: Parameters, fsm_only: bool = False) -> tuple[float, float, float]:
+# With cache set and a random seed given, the FSM is loaded from the FSM cache
+# when it has been built before, so the construction time measured is that of
+# loading it. With lazy set, table rows are only built as encoding and decoding
+# reach them, which is counted in their durations instead, and decoding keeps
+# the given number of survivors.
+def profile(
+    config: Parameters,
+    fsm_only: bool = False,
+    cache: bool = False,
+    lazy: bool = False,
+    beam: int = BEAM_WIDTH,
+) -> tuple[float, float, float]:
     output_size = 2 * config.symbol_size
 
     if config.reserved_bits >= output_size:
@@ -26,9 +39,33 @@ def profile(config: Parameters, fsm_only: bool = False) -> tuple[float, float, f
     )
 
     start_time = time.time()
-    fsm = construct_fsm_from_constraints(
-        init_state, input_size, output_size, config.constraints, config.choice_mechanism
-    )
+    if lazy:
+        fsm = LazyFSM(
+            init_state,
+            input_size,
+            output_size,
+            config.constraints,
+            config.choice_mechanism,
+            config.random_seed or 0,
+        )
+        fsm.beam = beam
+    elif cache:
+        fsm = cached_fsm(
+            init_state,
+            input_size,
+            output_size,
+            config.constraints,
+            config.choice_mechanism,
+            config.random_seed,
+        )
+    else:
+        fsm = construct_fsm_from_constraints(
+            init_state,
+            input_size,
+            output_size,
+            config.constraints,
+            config.choice_mechanism,
+        )
     fsm_duration = time.time() - start_time
     total += fsm_duration
     print(f"--- Constructing the FSM took {fsm_duration} seconds. ---")
@@ -26,11 +26,25 @@ pub(crate) fn gc_content(seq: &str) -> f32 {
     return seq.chars().filter(|c| *c == 'G' || *c == 'C').count() as f32 / seq.len() as f32;
 }
 
+// A unit of size bases repeats at i when each of the size bases from i equals the
+// base size further on, so rather than comparing slices at every position it is
+// enough to count how many bases in a row have matched.
 fn str_present(seq: &str, lower: usize, upper: usize) -> bool {
+    let bases = seq.as_bytes();
     for size in lower..=upper {
-        for i in 0..=seq.len() - (size * 2) {
-            if seq[i..i + size] == seq[i + size..i + (size * 2)] {
-                return true;
+        if size == 0 {
+            return true;
+        }
+
+        let mut matched = 0;
+        for i in 0..bases.len() - size {
+            if bases[i] == bases[i + size] {
+                matched += 1;
+                if matched == size {
+                    return true;
+                }
+            } else {
+                matched = 0;
             }
         }
     }
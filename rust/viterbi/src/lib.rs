@@ -3,6 +3,7 @@ use std::collections::HashMap;
 use pyo3::prelude::*;
 mod constraints;
 mod conv;
+mod serial;
 
 // Public types
 pub type Constraints = (f32, f32, usize, Vec<String>);
@@ -36,6 +37,12 @@ fn one_half() -> FSM {
     return (1, 2, String::from("00"), table);
 }
 
+// Loads an FSM saved by serialization.py.
+#[pyfunction]
+fn load_fsm(path: &str) -> PyResult<FSM> {
+    return serial::load_fsm(path).map_err(pyo3::exceptions::PyException::new_err);
+}
+
 // Convolutional encoder.
 #[pyfunction]
 fn encode(fsm: FSM, msg: String) -> String {
@@ -90,6 +97,7 @@ fn constraint_decode(fsm: FSM, constraints: Constraints, msg: String) -> Path {
 #[pymodule]
 fn viterbi(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(one_half, m)?)?;
+    m.add_function(wrap_pyfunction!(load_fsm, m)?)?;
     m.add_function(wrap_pyfunction!(encode, m)?)?;
     m.add_function(wrap_pyfunction!(decode, m)?)?;
     m.add_function(wrap_pyfunction!(constraint_decode, m)?)?;
@@ -0,0 +1,92 @@
+use crate::conv::Table;
+use std::collections::HashMap;
+use std::fs;
+
+// Layout of FSM files written by serialization.py.
+const MAGIC: &[u8] = b"DNAFSM\r\n";
+const VERSION: u32 = 1;
+const DATA_ALIGN: usize = 64;
+
+fn read_u32(data: &[u8], at: usize) -> u32 {
+    return u32::from_le_bytes([data[at], data[at + 1], data[at + 2], data[at + 3]]);
+}
+
+fn read_i32(data: &[u8], at: usize) -> i32 {
+    return i32::from_le_bytes([data[at], data[at + 1], data[at + 2], data[at + 3]]);
+}
+
+// Reads an FSM saved by serialization.py as (input_size, output_size, init_state, table).
+pub(crate) fn load_fsm(path: &str) -> Result<(usize, usize, String, Table), String> {
+    let data = fs::read(path).map_err(|e| e.to_string())?;
+    if data.len() < MAGIC.len() + 8 || &data[..MAGIC.len()] != MAGIC {
+        return Err(format!("{path} is not a saved FSM."));
+    }
+
+    let version = read_u32(&data, MAGIC.len());
+    if version != VERSION {
+        return Err(format!("Unsupported FSM file version {version}."));
+    }
+
+    let start = MAGIC.len() + 8;
+    let length = read_u32(&data, MAGIC.len() + 4) as usize;
+    if data.len() < start + length {
+        return Err(format!("{path} is truncated."));
+    }
+    let text = std::str::from_utf8(&data[start..start + length]).map_err(|e| e.to_string())?;
+
+    let mut header: HashMap<&str, &str> = HashMap::new();
+    for line in text.lines() {
+        if let Some((key, value)) = line.split_once('=') {
+            header.insert(key, value);
+        }
+    }
+    let field = |key: &str| {
+        header
+            .get(key)
+            .copied()
+            .ok_or(format!("FSM header has no {key}."))
+    };
+    let number = |key: &str| field(key)?.parse::<usize>().map_err(|e| e.to_string());
+
+    let input_size = number("input_size")?;
+    let output_size = number("output_size")?;
+    let num_states = number("num_states")?;
+    let init_state = number("init_state")?;
+    let states: Vec<&str> = field("states")?.split(',').collect();
+    if states.len() != num_states || init_state >= num_states {
+        return Err(format!("{path} has an inconsistent header."));
+    }
+
+    let num_inputs = 1 << input_size;
+    let size = num_states * num_inputs * 4;
+    let offset = start + length + (DATA_ALIGN - (start + length) % DATA_ALIGN) % DATA_ALIGN;
+    if data.len() < offset + 2 * size {
+        return Err(format!("{path} is truncated."));
+    }
+
+    let mut table: Table = HashMap::new();
+    for (s, state) in states.iter().enumerate() {
+        let mut row = HashMap::new();
+        for i in 0..num_inputs {
+            let at = 4 * (s * num_inputs + i);
+            let next = read_i32(&data, offset + at);
+            let output = read_i32(&data, offset + size + at);
+            if next < 0 {
+                continue;
+            }
+            if next as usize >= num_states {
+                return Err(format!("{path} has a transition to an unknown state."));
+            }
+            row.insert(
+                format!("{:0width$b}", i, width = input_size),
+                (
+                    states[next as usize].to_string(),
+                    format!("{:0width$b}", output, width = output_size),
+                ),
+            );
+        }
+        table.insert(state.to_string(), row);
+    }
+
+    return Ok((input_size, output_size, states[init_state].to_string(), table));
+}
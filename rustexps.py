@@ -10,10 +10,12 @@ from constraints import Constraints, default_constraints, standard_constraints
 from data_types import Path
 from dna_mapping import bits_to_dna, dna_to_bits
 from fsm import construct_fsm_from_constraints
+from fsm_cache import FSMCache, cached_rust_fsm, memory as fsm_memory, trellis_from_rust
+from metrics import repetition_errors
+from trellis import fingerprint
 from utils import (
     confusion,
     gc_content,
-    hamming_dist,
     inject_base_errors,
     inject_burst_errors,
     inject_deletion_errors,
@@ -58,34 +60,10 @@ class Parameters:
         )
 
 
-# TODO: Remove rust checks and neaten up
-def run_experiment(
-    params: Parameters = Parameters(),
-    verbose: bool = True,
-):
-    output_size = 2 * params.symbol_size
-
-    if params.reserved_bits >= output_size:
-        raise Exception("Too many reserved bits for given symbol size.")
-
-    input_size = output_size - params.reserved_bits
-    init_state = output_size * "0"
-
-    if params.random_seed is not None:
-        rn.seed(params.random_seed)
-
-    c = params.constraints
-    rs_cons = (
-        c.gc_min,
-        c.gc_max,
-        c.str_lower,
-        c.str_upper,
-        c.max_run_length,
-        c.reserved,
-    )
-
+# Builds the Rust FSM for the experiment's choice mechanism.
+def build_fsm(params: Parameters, init_state: str, rs_cons: tuple):
     if params.choice_mechanism == "random":
-        fsm = encoding.random_fsm(
+        return encoding.random_fsm(
             params.symbol_size,
             params.reserved_bits,
             init_state,
@@ -93,14 +71,14 @@ def run_experiment(
             params.random_seed,
         )
     elif params.choice_mechanism == "gc_tracking":
-        fsm = encoding.gc_tracking_fsm(
+        return encoding.gc_tracking_fsm(
             params.symbol_size,
             params.reserved_bits,
             init_state,
             rs_cons,
         )
     elif params.choice_mechanism == "gc_tracked_random":
-        fsm = encoding.gc_tracked_random_fsm(
+        return encoding.gc_tracked_random_fsm(
             params.symbol_size,
             params.reserved_bits,
             init_state,
@@ -108,7 +86,7 @@ def run_experiment(
             params.random_seed,
         )
     elif params.choice_mechanism == "similar":
-        fsm = encoding.most_similar_fsm(
+        return encoding.most_similar_fsm(
             params.symbol_size,
             params.reserved_bits,
             init_state,
@@ -116,7 +94,7 @@ def run_experiment(
             params.random_seed,
         )
     elif params.choice_mechanism == "different":
-        fsm = encoding.most_different_fsm(
+        return encoding.most_different_fsm(
             params.symbol_size,
             params.reserved_bits,
             init_state,
@@ -124,7 +102,7 @@ def run_experiment(
             params.random_seed,
         )
     elif params.choice_mechanism == "parity":
-        fsm = encoding.parity_fsm(
+        return encoding.parity_fsm(
             params.symbol_size,
             params.reserved_bits,
             init_state,
@@ -132,7 +110,7 @@ def run_experiment(
             params.random_seed,
         )
     elif params.choice_mechanism == "alt_parity":
-        fsm = encoding.alt_parity_fsm(
+        return encoding.alt_parity_fsm(
             params.symbol_size,
             params.reserved_bits,
             init_state,
@@ -140,7 +118,7 @@ def run_experiment(
             params.random_seed,
         )
     elif params.choice_mechanism == "xor":
-        fsm = encoding.xor_fsm(
+        return encoding.xor_fsm(
             params.symbol_size,
             params.reserved_bits,
             init_state,
@@ -148,7 +126,7 @@ def run_experiment(
             params.random_seed,
         )
     elif params.choice_mechanism == "random_unused":
-        fsm = encoding.random_unused_fsm(
+        return encoding.random_unused_fsm(
             params.symbol_size,
             params.reserved_bits,
             init_state,
@@ -158,6 +136,80 @@ def run_experiment(
     else:
         raise Exception("Invalid choice mechanism")
 
+
+# Number of simulated experiments whose results are kept for reuse.
+SIMULATED_CACHE_SIZE = 256
+
+# Results of the most recently simulated experiments and the random state after
+# each, keyed by the fingerprint of the FSM along with the seed and simulation
+# settings.
+simulated = FSMCache(SIMULATED_CACHE_SIZE)
+
+
+# TODO: Remove rust checks and neaten up
+def run_experiment(
+    params: Parameters = Parameters(),
+    verbose: bool = True,
+    cache: bool = True,
+    dedupe: bool = True,
+):
+    output_size = 2 * params.symbol_size
+
+    if params.reserved_bits >= output_size:
+        raise Exception("Too many reserved bits for given symbol size.")
+
+    input_size = output_size - params.reserved_bits
+    init_state = output_size * "0"
+
+    if params.random_seed is not None:
+        rn.seed(params.random_seed)
+
+    c = params.constraints
+    rs_cons = (
+        c.gc_min,
+        c.gc_max,
+        c.str_lower,
+        c.str_upper,
+        c.max_run_length,
+        c.reserved,
+    )
+
+    if cache:
+        fsm = cached_rust_fsm(
+            params.choice_mechanism,
+            params.symbol_size,
+            params.reserved_bits,
+            init_state,
+            params.constraints,
+            params.random_seed,
+            lambda: build_fsm(params, init_state, rs_cons),
+        )
+    else:
+        fsm = build_fsm(params, init_state, rs_cons)
+
+    # Simulations only depend on the code and the seeded random state, so FSMs
+    # which are the same code up to state names are simulated once per seed and
+    # settings. The random state after simulating is restored on reuse so that
+    # later seeds drawn from it are unchanged.
+    key = None
+    if dedupe and params.random_seed is not None:
+        key = (
+            fingerprint(trellis_from_rust(fsm)),
+            params.random_seed,
+            params.error_rate,
+            params.sequence_length,
+            params.repetitions,
+            params.gc_window,
+        )
+        reused = simulated.get(key)
+        if reused is not None:
+            results, state = reused
+            rn.setstate(state)
+            if verbose:
+                print(f"\nREUSING RESULTS OF AN IDENTICAL FSM\n")
+                print(params)
+            return results
+
     # conf = confusion()
     # fsm = viterbi.one_half()
 
@@ -216,23 +268,20 @@ def run_experiment(
         # The estimated DNA sequence.
         dna_cor = encoding.bits_to_dna(observed)
 
-        # Add data to confusion matrix
-        # conf += confusion(dna, dna_cor)
-
-        # Number of errors occuring in the DNA.
-        dna_error = hamming_dist(dna, dna_err)
-
-        # Number of errors remaining after DNA sequence is corrected.
-        rem_dna_error = hamming_dist(dna, dna_cor)
-
-        # Number of errors between the encoded and received strings.
-        bit_error = hamming_dist(enc, err)
-
-        # Number of errors remaining after the received string is corrected.
-        rem_bit_error = hamming_dist(enc, observed)
+        # Errors occuring in the DNA and remaining after it is corrected, between
+        # the encoded and received strings and remaining after the received
+        # string is corrected, and in the decoded sequence.
+        errors = repetition_errors(
+            seq, result, enc, err, observed, dna, dna_err, dna_cor
+        )
+        dna_error = errors.dna_injected
+        rem_dna_error = errors.dna_remaining
+        bit_error = errors.bits_injected
+        rem_bit_error = errors.bits_remaining
+        seq_error = errors.sequence
 
-        # Number of errors in the decoded sequence.
-        seq_error = hamming_dist(seq, result)
+        # Add data to confusion matrix
+        # conf += errors.confusion
 
         dna_errors_injected.append(dna_error)
         dna_errors_remaining.append(rem_dna_error)
@@ -277,7 +326,7 @@ def run_experiment(
 
     # print(f"STRs: {strs}")
 
-    return (
+    results = (
         avg_dna_error,
         avg_rem_dna_error,
         avg_bit_error,
@@ -292,6 +341,10 @@ def run_experiment(
         # conf,
     )
 
+    if key is not None:
+        simulated.put(key, (results, rn.getstate()))
+    return results
+
 
 def define_experiments(
     config: Parameters,
@@ -389,6 +442,7 @@ def run_error_range(
             # strs.extend(s)
 
     print_results(name, config, dna_err, seq_err, gc_win, gcs, gc_vars, str_lens, strs)
+    print(f"FSM cache: {fsm_memory.hits} hits, {fsm_memory.misses} misses")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,185 @@
+import numpy as np
+import os
+import struct
+from constraints import Constraints
+from fsm import FSM
+from fsm_cache import trellis_to_rust
+from trellis import Trellis
+
+# Saved FSMs are read from Rust with viterbi.load_fsm, or here with load_fsm or
+# to_rust.
+#
+# File layout: MAGIC, then the format version and the header length as
+# little-endian uint32, then the header, zero padding up to a multiple of
+# DATA_ALIGN bytes, and finally the next state and output arrays as
+# little-endian int32 in row-major [state, input] order. The header is UTF-8
+# key=value lines, with lists comma separated, so that it is easy to read from
+# Rust as well as Python.
+MAGIC = b"DNAFSM\r\n"
+VERSION = 1
+DATA_ALIGN = 64
+
+DTYPE = np.dtype("<i4")
+
+CONSTRAINT_KEYS = ["gc_min", "gc_max", "str_lower", "str_upper", "max_run_length"]
+
+
+# Saves a compiled FSM along with what it was built from, if given.
+def save(
+    path: str,
+    fsm,
+    constraints: Constraints = None,
+    mechanism=None,
+    seed=None,
+):
+    trellis = fsm.trellis if isinstance(fsm, FSM) else fsm
+    with open(path, "wb") as f:
+        f.write(header_bytes(trellis, constraints, mechanism, seed))
+        f.write(np.ascontiguousarray(trellis.next_state, dtype=DTYPE).tobytes())
+        f.write(np.ascontiguousarray(trellis.output, dtype=DTYPE).tobytes())
+
+
+# Everything before the arrays: magic, version, header and padding.
+def header_bytes(
+    trellis: Trellis,
+    constraints: Constraints = None,
+    mechanism=None,
+    seed=None,
+) -> bytes:
+    header = {
+        "input_size": trellis.input_size,
+        "output_size": trellis.output_size,
+        "num_states": trellis.num_states,
+        "init_state": trellis.init_state,
+        "states": ",".join(trellis.states),
+    }
+    if mechanism is not None:
+        header["mechanism"] = getattr(mechanism, "__name__", mechanism)
+    if seed is not None:
+        header["seed"] = seed
+    if constraints is not None:
+        if any("," in r for r in constraints.reserved):
+            raise Exception("Reserved subsequences containing commas cannot be saved.")
+        for key in CONSTRAINT_KEYS:
+            header[key] = getattr(constraints, key)
+        header["reserved"] = ",".join(constraints.reserved)
+
+    lines = []
+    for key, value in header.items():
+        value = str(value)
+        if "\n" in value:
+            raise Exception(f"FSM header value for {key} cannot be saved.")
+        lines.append(f"{key}={value}\n")
+    text = "".join(lines).encode()
+
+    start = len(MAGIC) + 8 + len(text)
+    padding = -start % DATA_ALIGN
+    return MAGIC + struct.pack("<II", VERSION, len(text)) + text + b"\0" * padding
+
+
+# Reads the header of a saved FSM, returning the header fields and the offset of
+# the array data.
+def read_header(path: str) -> tuple[dict, int]:
+    with open(path, "rb") as f:
+        start = f.read(len(MAGIC) + 8)
+        _, length = check_start(start, path)
+        return parse_header(start + f.read(length))
+
+
+# Parses the header at the start of the given bytes, as written by header_bytes.
+def parse_header(data, name: str = "data") -> tuple[dict, int]:
+    _, length = check_start(data, name)
+    start = len(MAGIC) + 8
+    text = bytes(data[start : start + length]).decode()
+
+    header = {}
+    for line in text.splitlines():
+        key, value = line.split("=", 1)
+        header[key] = value
+
+    start += length
+    return header, start + (-start % DATA_ALIGN)
+
+
+def check_start(data, name: str) -> tuple[int, int]:
+    if bytes(data[: len(MAGIC)]) != MAGIC:
+        raise Exception(f"{name} is not a saved FSM.")
+    version, length = struct.unpack("<II", bytes(data[len(MAGIC) : len(MAGIC) + 8]))
+    if version != VERSION:
+        raise Exception(f"Unsupported FSM file version {version}.")
+    return version, length
+
+
+# Shape of the next state and output arrays given the header fields.
+def array_shape(header: dict) -> tuple[int, int]:
+    return int(header["num_states"]), 2 ** int(header["input_size"])
+
+
+# Maps the next state and output arrays of a saved FSM read-only into memory.
+# Every process mapping the same file shares one copy of them.
+def map_arrays(path: str) -> tuple[np.ndarray, np.ndarray]:
+    header, offset = read_header(path)
+    shape = array_shape(header)
+    size = shape[0] * shape[1] * DTYPE.itemsize
+
+    next_state = np.memmap(path, dtype=DTYPE, mode="r", offset=offset, shape=shape)
+    output = np.memmap(path, dtype=DTYPE, mode="r", offset=offset + size, shape=shape)
+    return next_state, output
+
+
+# Loads a saved FSM's trellis without copying its arrays, along with what it was
+# built from: the constraints, mechanism name and seed, each None if not saved.
+def load(path: str) -> tuple[Trellis, dict]:
+    header, _ = read_header(path)
+    next_state, output = map_arrays(path)
+
+    trellis = header_trellis(header, next_state, output)
+    trellis.source = os.path.abspath(path)
+    return trellis, header_info(header)
+
+
+def header_trellis(header: dict, next_state: np.ndarray, output: np.ndarray) -> Trellis:
+    return Trellis(
+        header["states"].split(","),
+        int(header["init_state"]),
+        next_state,
+        output,
+        int(header["input_size"]),
+        int(header["output_size"]),
+    )
+
+
+# The constraints, mechanism name and seed recorded in a header.
+def header_info(header: dict) -> dict:
+    constraints = None
+    if "reserved" in header:
+        reserved = header["reserved"].split(",") if header["reserved"] else []
+        constraints = Constraints(
+            float(header["gc_min"]),
+            float(header["gc_max"]),
+            int(header["str_lower"]),
+            int(header["str_upper"]),
+            int(header["max_run_length"]),
+            reserved,
+        )
+
+    seed = header.get("seed")
+    if seed is not None and seed.lstrip("-").isdigit():
+        seed = int(seed)
+
+    return {
+        "constraints": constraints,
+        "mechanism": header.get("mechanism"),
+        "seed": seed,
+    }
+
+
+def load_fsm(path: str, decoder: str = "traceback") -> FSM:
+    trellis, _ = load(path)
+    return FSM.from_trellis(trellis, decoder)
+
+
+# A saved FSM as the tuple taken by the Rust encoder and decoder.
+def to_rust(path: str):
+    trellis, _ = load(path)
+    return trellis_to_rust(trellis)
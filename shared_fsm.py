@@ -0,0 +1,83 @@
+import numpy as np
+import sys
+from multiprocessing import parent_process, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from serialization import DTYPE, array_shape, header_bytes, header_trellis, parse_header
+from trellis import Trellis
+
+# Names of the blocks published by this process.
+published = set()
+
+
+# Copies a trellis into a new shared memory block, laid out as a saved FSM file,
+# so that worker processes can attach to it by name without copying or pickling
+# the arrays. The caller owns the block and must close and unlink it once every
+# worker is done with it.
+def publish(trellis: Trellis, name: str = None) -> SharedMemory:
+    head = header_bytes(trellis)
+    size = trellis.next_state.size * DTYPE.itemsize
+    block = SharedMemory(name=name, create=True, size=len(head) + 2 * size)
+    block.buf[: len(head)] = head
+    published.add(block.name)
+
+    header, offset = parse_header(block.buf, block.name)
+    next_state, output = views(block, array_shape(header), offset)
+    next_state[...] = trellis.next_state
+    output[...] = trellis.output
+    # The block cannot be closed while views of it exist.
+    del next_state, output
+    return block
+
+
+# A trellis whose arrays are read-only views of the shared memory block with the
+# given name. The block stays mapped for as long as the trellis exists. Tracked
+# says whether this process shares the resource tracker of the publisher, as its
+# workers do however they were started. By default that is assumed for the
+# publisher itself and for any process started by multiprocessing.
+def attach(name: str, tracked: bool = None) -> Trellis:
+    block = open_block(name, tracked)
+    header, offset = parse_header(block.buf, name)
+    next_state, output = views(block, array_shape(header), offset)
+    next_state.flags.writeable = False
+    output.flags.writeable = False
+
+    trellis = header_trellis(header, next_state, output)
+    trellis.shared = name
+    trellis._block = block
+    return trellis
+
+
+# Numpy does not keep the block itself alive, and a block which is garbage
+# collected unmaps its memory from under any views of it. Views are instead
+# taken through this wrapper, which becomes their base and holds the block.
+class Mapped:
+    def __init__(self, array: np.ndarray, block: SharedMemory):
+        self.__array_interface__ = array.__array_interface__
+        self.block = block
+
+
+def views(
+    block: SharedMemory, shape: tuple[int, int], offset: int
+) -> tuple[np.ndarray, np.ndarray]:
+    size = shape[0] * shape[1] * DTYPE.itemsize
+    next_state = np.ndarray(shape, dtype=DTYPE, buffer=block.buf, offset=offset)
+    output = np.ndarray(shape, dtype=DTYPE, buffer=block.buf, offset=offset + size)
+    return np.asarray(Mapped(next_state, block)), np.asarray(Mapped(output, block))
+
+
+# Before Python 3.13 attaching to a block registers it with the resource tracker
+# as if this process had created it, so that it would be unlinked as soon as an
+# unrelated process attached to it exits. Only the publisher should own it, so
+# such processes drop the registration again straight after attaching. Processes
+# sharing the publisher's resource tracker must leave it alone, as it is the
+# publisher's own registration.
+def open_block(name: str, tracked: bool = None) -> SharedMemory:
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+
+    if tracked is None:
+        tracked = name in published or parent_process() is not None
+    block = SharedMemory(name=name)
+    if not tracked:
+        resource_tracker.unregister(block._name, "shared_memory")
+    return block
@@ -0,0 +1,102 @@
+import numpy as np
+from fsm import FSM
+from trellis import (
+    UNREACHED,
+    acs_step,
+    best_state,
+    bits_to_symbols,
+    initial_metrics,
+    traceback,
+)
+
+# Default number of undecided symbols kept before the oldest is forced out.
+TRACEBACK_DEPTH = 32
+
+
+# Viterbi decoder that accepts the received message in chunks and emits decoded
+# bits as soon as every survivor agrees on them, or once they are more than
+# depth symbols old, in which case the current best survivor decides them. Only
+# backpointers for undecided symbols are kept, so memory is bounded by the
+# traceback depth rather than the message length. The result is identical to
+# decoding the whole message whenever survivors converge within depth symbols.
+class StreamDecoder:
+    def __init__(self, fsm: FSM, depth: int = TRACEBACK_DEPTH):
+        if depth < 1:
+            raise Exception("Traceback depth must be at least one symbol.")
+
+        self.trellis = fsm.trellis
+        self.output_size = fsm.output_size
+        self.depth = depth
+        self.metric, self.rank = initial_metrics(
+            self.trellis, self.trellis.init_state
+        )
+        self.length = 0
+        self.backpointers = []
+        self.pending = ""
+
+    # Decodes a chunk of received bits, returning the newly decided input bits
+    # and the corresponding observations.
+    def push(self, received: str) -> tuple[str, str]:
+        bits = self.pending + received
+        usable = len(bits) - len(bits) % self.output_size
+        self.pending = bits[usable:]
+
+        steps = []
+        for symbol in bits_to_symbols(bits[:usable], self.output_size):
+            self.metric, self.rank, pointers = acs_step(
+                self.trellis, self.metric, self.rank, symbol
+            )
+            self.backpointers.append(pointers)
+
+            if len(self.backpointers) >= 2 * self.depth:
+                state = best_state(self.metric, self.rank)
+                steps.extend(self._release(state, len(self.backpointers) - self.depth))
+
+        steps.extend(self._converged())
+
+        # Keep metrics small on long streams, this does not change any decision.
+        reached = self.metric != UNREACHED
+        offset = self.metric[reached].min()
+        self.metric[reached] -= offset
+        self.length += int(offset)
+
+        return self._labels(steps)
+
+    # Decodes everything still undecided at the end of the message.
+    def flush(self) -> tuple[str, str]:
+        if self.pending:
+            raise Exception(
+                "The length of the received message must be a multiple of the symbol size."
+            )
+
+        state = best_state(self.metric, self.rank)
+        self.length += int(self.metric[state])
+        return self._labels(self._release(state, len(self.backpointers)))
+
+    # Traces back from the given state and removes the oldest count steps.
+    def _release(self, state: int, count: int) -> list[tuple[int, int]]:
+        steps = traceback(self.trellis, self.backpointers, state)[:count]
+        del self.backpointers[:count]
+        return steps
+
+    # Releases the steps all survivors share, if any.
+    def _converged(self) -> list[tuple[int, int]]:
+        states = np.nonzero(self.metric != UNREACHED)[0]
+        for k in range(len(self.backpointers) - 1, -1, -1):
+            pointers = np.unique(self.backpointers[k][states])
+            if len(pointers) == 1:
+                state, input = divmod(int(pointers[0]), self.trellis.num_inputs)
+                steps = traceback(self.trellis, self.backpointers[:k], state)
+                steps.append((state, input))
+                del self.backpointers[: k + 1]
+                return steps
+            states = np.unique(pointers // self.trellis.num_inputs)
+        return []
+
+    def _labels(self, steps: list[tuple[int, int]]) -> tuple[str, str]:
+        inputs = []
+        outputs = []
+        for state, input in steps:
+            inputs.append(self.trellis.input_label(input))
+            outputs.append(self.trellis.output_label(self.trellis.output[state, input]))
+        return "".join(inputs), "".join(outputs)
@@ -0,0 +1,59 @@
+import numpy as np
+
+
+# Bytes of a string, or the given array of base numbers unchanged.
+def sequence_array(sequence) -> np.ndarray:
+    if isinstance(sequence, str):
+        return np.frombuffer(sequence.encode(), dtype=np.uint8)
+    return np.asarray(sequence)
+
+
+# Number of positions at which a unit of each size from lower to upper is
+# immediately repeated, keyed by size. A unit of size s repeats at i when each of
+# the s bases from i equals the base s further on, so every size is counted at
+# once from prefix sums of those equalities. Unless last is set, a repeat ending
+# on the final base is not counted, as in utils.strs. Bases where valid is False
+# never match, so that runs of unknown bases are not counted as repeats.
+def repeat_counts(
+    sequence, lower: int, upper: int, last: bool = True, valid: np.ndarray = None
+) -> dict[int, int]:
+    if lower < 1:
+        raise Exception("Tandem repeats must be at least one base long.")
+
+    bases = sequence_array(sequence)
+    n = len(bases)
+    counts = {size: 0 for size in range(lower, upper + 1)}
+    sizes = np.arange(lower, min(upper, n // 2) + 1)[:, None]
+    if len(sizes) == 0:
+        return counts
+
+    positions = np.arange(n)
+    later = positions + sizes
+    same = (bases == bases[np.minimum(later, n - 1)]) & (later < n)
+    if valid is not None:
+        same &= valid & valid[np.minimum(later, n - 1)]
+    sums = np.zeros((len(sizes), n + 1), dtype=np.int64)
+    sums[:, 1:] = same.cumsum(1)
+
+    ends = np.minimum(later, n)
+    repeated = np.take_along_axis(sums, ends, 1) - sums[:, :n] == sizes
+    repeated &= positions <= n - 2 * sizes - (0 if last else 1)
+    for size, count in zip(sizes[:, 0], repeated.sum(1)):
+        counts[int(size)] = int(count)
+    return counts
+
+
+# Whether any unit of lower to upper bases is immediately repeated.
+def str_present(sequence, lower: int, upper: int) -> bool:
+    return any(count > 0 for count in repeat_counts(sequence, lower, upper).values())
+
+
+if __name__ == "__main__":
+    print(repeat_counts("ACGACGT", 1, 3) == {1: 0, 2: 0, 3: 1})
+    print(repeat_counts("ACGACG", 3, 3, last=False) == {3: 0})
+    print(repeat_counts("AAAA", 1, 2) == {1: 3, 2: 1})
+    print(repeat_counts("NNNNNNNN", 3, 4) == {3: 3, 4: 1})
+
+    codes = np.array([4] * 8, dtype=np.uint8)
+    print(repeat_counts(codes, 3, 4, valid=codes < 4) == {3: 0, 4: 0})
+    print(str_present("ACGTNNNNNNNNACGT", 3, 4))
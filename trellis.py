@@ -0,0 +1,405 @@
+import hashlib
+import numpy as np
+from data_types import Transition
+from typing import Optional
+from utils import table_from_list
+
+
+# Compiled, integer-indexed form of a transition table. States are numbered in
+# the order they appear in the table and inputs/outputs are stored as the
+# integer value of their bit strings, so next_state[state, input] and
+# output[state, input] replace the dict lookups. Missing transitions are -1.
+class Trellis:
+    def __init__(
+        self,
+        states: list[str],
+        init_state: int,
+        next_state: np.ndarray,
+        output: np.ndarray,
+        input_size: int,
+        output_size: int,
+    ):
+        self.states = states
+        self.index = {s: i for i, s in enumerate(states)}
+        self.init_state = init_state
+        self.next_state = next_state
+        self.output = output
+        self.input_size = input_size
+        self.output_size = output_size
+        self._branch_metrics = None
+        self._edges = None
+
+        # File or shared memory block the arrays are mapped from, if any.
+        self.source = None
+        self.shared = None
+
+    # Cached lookup tables are rebuilt on demand rather than pickled, which keeps
+    # trellises cheap to send to worker processes. Trellises loaded from a file or
+    # attached to shared memory are mapped again rather than copied.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_branch_metrics"] = None
+        state["_edges"] = None
+        state.pop("_block", None)
+        if self.source is not None or self.shared is not None:
+            state["next_state"] = None
+            state["output"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.shared is not None:
+            from shared_fsm import attach
+
+            attached = attach(self.shared)
+            self.next_state, self.output = attached.next_state, attached.output
+            self._block = attached._block
+        elif self.source is not None:
+            from serialization import map_arrays
+
+            self.next_state, self.output = map_arrays(self.source)
+
+    # Hamming distance between every received symbol and every output symbol,
+    # indexed as branch_metrics[received, output]. Built on first use.
+    @property
+    def branch_metrics(self) -> np.ndarray:
+        if self._branch_metrics is None:
+            symbols = np.arange(2**self.output_size, dtype=np.uint32)
+            self._branch_metrics = popcount(symbols[:, None] ^ symbols[None, :])
+        return self._branch_metrics
+
+    # Transitions grouped by next state for the vectorised decoder, built on first use.
+    @property
+    def edges(self) -> "Edges":
+        if self._edges is None:
+            self._edges = Edges(self)
+        return self._edges
+
+    # Maps each output symbol to the state it leads to, or None if some output
+    # leads to different states from different starting states. Tables built
+    # from constraints always move to the state equal to their output.
+    def next_of_output(self) -> Optional[np.ndarray]:
+        edges = self.edges
+        pairs = np.unique(np.stack([edges.output, edges.next]), axis=1)
+        if len(np.unique(pairs[0])) != pairs.shape[1]:
+            return None
+
+        next = np.full(2**self.output_size, -1, dtype=np.int64)
+        next[pairs[0]] = pairs[1]
+        return next
+
+    @property
+    def num_states(self) -> int:
+        return self.next_state.shape[0]
+
+    @property
+    def num_inputs(self) -> int:
+        return self.next_state.shape[1]
+
+    def input_label(self, input: int) -> str:
+        return format(input, f"0{self.input_size}b")
+
+    def output_label(self, output: int) -> str:
+        return format(output, f"0{self.output_size}b")
+
+    def transition(self, state: int, input: int) -> Transition:
+        return Transition(
+            start=self.states[state],
+            next=self.states[self.next_state[state, input]],
+            input=self.input_label(input),
+            output=self.output_label(self.output[state, input]),
+        )
+
+    def to_table(self):
+        transitions = []
+        for s in range(self.num_states):
+            for i in range(self.num_inputs):
+                if self.next_state[s, i] >= 0:
+                    transitions.append(self.transition(s, i))
+        return table_from_list(transitions)
+
+
+# The part of a trellis reachable from its initial state with states renumbered
+# in breadth-first order, following inputs in order. Two trellises have the same
+# canonical form exactly when they are the same code up to the naming of states,
+# and so encode and decode every message identically. Returns the renumbered
+# next_state and output arrays, with unreachable states dropped.
+def canonical_form(trellis: Trellis) -> tuple[np.ndarray, np.ndarray]:
+    label = np.full(trellis.num_states + 1, -1, dtype=np.int64)
+    label[trellis.init_state] = 0
+    order = [trellis.init_state]
+    frontier = np.array(order)
+
+    while len(frontier) > 0:
+        next = trellis.next_state[frontier].ravel()
+        next = next[(next >= 0) & (label[next] < 0)]
+        # New states in order of first appearance, as a queue would find them.
+        _, first = np.unique(next, return_index=True)
+        frontier = next[np.sort(first)]
+        label[frontier] = np.arange(len(order), len(order) + len(frontier))
+        order.extend(frontier.tolist())
+
+    # Missing transitions index the extra entry of label, which stays -1.
+    next_state = trellis.next_state[order]
+    next_state = label[np.where(next_state >= 0, next_state, trellis.num_states)]
+    return next_state.astype(np.int32), trellis.output[order].astype(np.int32)
+
+
+# Hash of the canonical form, equal for trellises which are the same code.
+def fingerprint(trellis: Trellis) -> str:
+    next_state, output = canonical_form(trellis)
+    digest = hashlib.sha256()
+    digest.update(f"{trellis.input_size},{trellis.output_size},".encode())
+    digest.update(next_state.tobytes())
+    digest.update(output.tobytes())
+    return digest.hexdigest()
+
+
+def compile_table(table, init_state: str, input_size: int, output_size: int) -> Trellis:
+    index = {s: i for i, s in enumerate(table)}
+    for row in table.values():
+        for t in row.values():
+            if t is not None and t.next not in index:
+                index[t.next] = len(index)
+    if init_state not in index:
+        index[init_state] = len(index)
+
+    states = list(index)
+    next_state = np.full((len(states), 2**input_size), -1, dtype=np.int32)
+    output = np.full((len(states), 2**input_size), -1, dtype=np.int32)
+
+    for state, row in table.items():
+        for input, t in row.items():
+            if t is None:
+                continue
+            if len(input) != input_size or len(t.output) != output_size:
+                raise Exception(f"Transition {t} does not match the FSM symbol sizes.")
+            next_state[index[state], int(input, 2)] = index[t.next]
+            output[index[state], int(input, 2)] = int(t.output, 2)
+
+    return Trellis(
+        states, index[init_state], next_state, output, input_size, output_size
+    )
+
+
+# Number of set bits in each element of an unsigned integer array.
+def popcount(values: np.ndarray) -> np.ndarray:
+    values = np.ascontiguousarray(values)
+    table = np.array([bin(x).count("1") for x in range(256)], dtype=np.uint8)
+    per_byte = table[values.view(np.uint8)].reshape(*values.shape, values.itemsize)
+    return per_byte.sum(axis=-1, dtype=np.uint8)
+
+
+# Splits a bit string into consecutive symbols of the given size as integers.
+def bits_to_symbols(bits: str, size: int) -> np.ndarray:
+    if len(bits) % size != 0:
+        raise Exception(f"Bit string length must be a multiple of {size}.")
+
+    arr = np.frombuffer(bits.encode(), dtype=np.uint8) - ord("0")
+    if np.any(arr > 1):
+        raise Exception("Bit string contains symbols other than 0 and 1.")
+
+    weights = 1 << np.arange(size - 1, -1, -1, dtype=np.int64)
+    return arr.reshape(-1, size).astype(np.int64) @ weights
+
+
+# Inverse of bits_to_symbols.
+def symbols_to_bits(symbols, size: int) -> str:
+    symbols = np.asarray(symbols, dtype=np.int64)
+    shifts = np.arange(size - 1, -1, -1, dtype=np.int64)
+    bits = ((symbols[:, None] >> shifts) & 1).astype(np.uint8) + ord("0")
+    return bits.tobytes().decode()
+
+
+# Transitions of a trellis flattened and grouped by next state, so that the
+# add-compare-select step of Viterbi can be done as whole-array work with a
+# segmented min-reduction per next state.
+class Edges:
+    def __init__(self, trellis: Trellis):
+        state, input = np.nonzero(trellis.next_state >= 0)
+        next = trellis.next_state[state, input]
+        order = np.argsort(next, kind="stable")
+
+        self.state = state[order].astype(np.int64)
+        self.input = input[order].astype(np.int64)
+        self.next = next[order].astype(np.int64)
+        self.output = trellis.output[state, input][order].astype(np.int64)
+
+        # Start of the run of edges entering each reachable next state.
+        self.targets, self.starts = np.unique(self.next, return_index=True)
+
+        # Whether every edge into a state has the same output, as in tables built
+        # from constraints where the next state is the output, so that branch
+        # metrics can be added after the minimum over each state's edges.
+        self.target_output = self.output[self.starts]
+        counts = np.diff(np.append(self.starts, len(self.output)))
+        self.shared_output = bool(
+            np.all(self.output == np.repeat(self.target_output, counts))
+        )
+
+
+# Metric of states no survivor has reached yet.
+UNREACHED = np.iinfo(np.int64).max
+
+
+# Metrics and ranks before any symbol is received, with a single survivor in
+# the given state, or a survivor in every state if start is None.
+def initial_metrics(trellis: Trellis, start: int) -> tuple[np.ndarray, np.ndarray]:
+    if start is None:
+        metric = np.zeros(trellis.num_states, dtype=np.int64)
+        rank = np.arange(trellis.num_states, dtype=np.int64)
+        return metric, rank
+
+    metric = np.full(trellis.num_states, UNREACHED, dtype=np.int64)
+    rank = np.zeros(trellis.num_states, dtype=np.int64)
+    metric[start] = 0
+    return metric, rank
+
+
+# Packed candidate of a state no survivor has reached, above every real one.
+FAR = 2**62
+
+
+# One vectorised add-compare-select step over a whole trellis. Ties are broken
+# exactly as in FSM.path_viterbi, which keeps survivors in the order they were
+# first reached and only replaces one with a strictly shorter path, so each
+# survivor carries its rank in that order alongside its metric. Returns the new
+# metrics and ranks, and for each next state the winning state * num_inputs +
+# input, or -1 if it was not reached. Metrics and ranks may have a leading batch
+# dimension of shape (reads, states), in which case symbol holds one symbol per
+# read. Each read's row is contiguous, so every gather and reduction runs along
+# rows and batching reads shares the cost of indexing the edges.
+def acs_step(
+    trellis: Trellis, metric: np.ndarray, rank: np.ndarray, symbol
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if metric.ndim == 1:
+        metric, rank, pointers = acs_step(
+            trellis, metric[None], rank[None], np.array([symbol])
+        )
+        return metric[0], rank[0], pointers[0]
+
+    edges = trellis.edges
+    num_inputs = trellis.num_inputs
+    reads = np.arange(len(metric))[:, None]
+
+    # Candidates are compared on metric first, then on the rank of the state they
+    # came from and finally on input, packed into a single integer.
+    keys = trellis.num_states * num_inputs
+    reached = metric != UNREACHED
+    order = np.where(reached, rank * num_inputs, FAR)
+    packed = np.where(reached, metric * keys, 0) + order
+    branch = trellis.branch_metrics[symbol].astype(np.int64) * keys
+
+    candidates = np.take(packed, edges.state, axis=1)
+    if not edges.shared_output:
+        candidates += np.take(branch, edges.output, axis=1)
+    candidates += edges.input
+    best = np.minimum.reduceat(candidates, edges.starts, axis=1)
+    if edges.shared_output:
+        best += np.take(branch, edges.target_output, axis=1)
+
+    first = np.take(order, edges.state, axis=1)
+    first += edges.input
+    first = np.minimum.reduceat(first, edges.starts, axis=1)
+    found = first < FAR
+
+    # Map the rank of the winning predecessor back to its state.
+    by_rank = np.zeros_like(metric)
+    read, state = np.nonzero(reached)
+    by_rank[read, rank[read, state]] = state
+    prev_rank, input = np.divmod(np.where(found, best % keys, 0), num_inputs)
+    prev_state = by_rank[reads, prev_rank]
+    pointers = np.full(metric.shape, -1, dtype=np.int64)
+    pointers[:, edges.targets] = np.where(found, prev_state * num_inputs + input, -1)
+
+    metric = np.full(metric.shape, UNREACHED, dtype=np.int64)
+    metric[:, edges.targets] = np.where(found, best // keys, UNREACHED)
+
+    # Reached states have distinct first candidates, and the ranks of states that
+    # were not reached are never read, so the sort need not be stable.
+    rank = np.zeros(metric.shape, dtype=np.int64)
+    rank[reads, edges.targets[np.argsort(first, axis=1)]] = np.arange(first.shape[1])
+
+    return metric, rank, pointers
+
+
+# The survivor with the lowest metric, taking the first reached on ties.
+def best_state(metric: np.ndarray, rank: np.ndarray) -> int:
+    reached = np.nonzero(metric != UNREACHED)[0]
+    if len(reached) == 0:
+        raise Exception("No path through the trellis fits the received message.")
+    return int(reached[np.argmin(metric[reached] * len(metric) + rank[reached])])
+
+
+# Follows backpointers from the given final state, returning the (state, input)
+# pair taken at each step.
+def traceback(
+    trellis: Trellis, backpointers: list[np.ndarray], state: int
+) -> list[tuple[int, int]]:
+    steps = []
+    for pointers in reversed(backpointers):
+        state, input = divmod(int(pointers[state]), trellis.num_inputs)
+        steps.append((state, input))
+    steps.reverse()
+    return steps
+
+
+# Vectorised Viterbi over a whole trellis. Decoding starts from the given state,
+# or the initial state by default, or from every state at once if free_start is
+# set. If an end state is given the path ends there, or None is returned if no
+# survivor reaches it.
+def acs_viterbi(
+    trellis: Trellis,
+    symbols: np.ndarray,
+    start: int = None,
+    end: int = None,
+    free_start: bool = False,
+) -> Optional[list[tuple[int, int]]]:
+    if start is None and not free_start:
+        start = trellis.init_state
+    metric, rank = initial_metrics(trellis, start)
+    backpointers = []
+
+    for symbol in symbols:
+        metric, rank, pointers = acs_step(trellis, metric, rank, symbol)
+        backpointers.append(pointers)
+
+    if end is None:
+        state = best_state(metric, rank)
+    elif metric[end] != UNREACHED:
+        state = end
+    else:
+        return None
+
+    return traceback(trellis, backpointers, state)
+
+
+# Vectorised Viterbi over many equal-length reads at once, with symbols of shape
+# (reads, length). Returns the state and input taken at each step of every read
+# along with the metric of each read's best path.
+def acs_viterbi_batch(
+    trellis: Trellis, symbols: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    reads, length = symbols.shape
+    metric, rank = initial_metrics(trellis, trellis.init_state)
+    metric = np.tile(metric, (reads, 1))
+    rank = np.tile(rank, (reads, 1))
+    backpointers = []
+
+    for t in range(length):
+        metric, rank, pointers = acs_step(trellis, metric, rank, symbols[:, t])
+        backpointers.append(pointers.astype(np.int32))
+
+    state = np.array([best_state(m, r) for m, r in zip(metric, rank)])
+    lengths = metric[np.arange(reads), state]
+
+    states = np.empty((reads, length), dtype=np.int64)
+    inputs = np.empty((reads, length), dtype=np.int64)
+    for t in range(length - 1, -1, -1):
+        state, inputs[:, t] = np.divmod(
+            backpointers[t][np.arange(reads), state].astype(np.int64),
+            trellis.num_inputs,
+        )
+        states[:, t] = state
+
+    return states, inputs, lengths
@@ -1,6 +1,8 @@
 import numpy as np
 import random as rn
 from data_types import Transition
+from gc_profile import base_codes, gc_sums, window_gc
+from tandem_repeats import repeat_counts
 
 
 def table_from_list(transitions: list[Transition]):
@@ -74,13 +76,7 @@ def burst_score(true: str, pred: str) -> int:
 
 
 def strs(sequence: str, size: int = 4) -> int:
-    count = 0
-    for i in range(len(sequence) - size * 2):
-        one = sequence[i : i + size]
-        two = sequence[i + size : i + size * 2]
-        if one == two:
-            count += 1
-    return count
+    return repeat_counts(sequence, size, size, last=False)[size]
 
 
 def rand_bit_string(length: int) -> str:
@@ -182,15 +178,6 @@ def sequence_is_valid(sequence: str) -> bool:
     return all([base in "ACGT" for base in sequence])
 
 
-def contains_reserved(sequence: str, reserved: list[str]) -> bool:
-    for r in reserved:
-        if len(r) > len(sequence):
-            raise Exception(f"Reserved subsequence is longer than the given sequence.")
-        if r in sequence:
-            return True
-    return False
-
-
 def gc_content(sequence: str) -> float:
     gc = 0
     for base in sequence:
@@ -201,19 +188,19 @@ def gc_content(sequence: str) -> float:
     return float(gc) / float(len(sequence))
 
 
+# Largest difference in GC content between windows of the given size starting
+# at 0, 1, 1 + step, 1 + 2 * step and so on, from prefix sums of the GC count.
 def max_gc_variance(sequence: str, window: int = 4, step: int = 1) -> float:
-    gc = gc_content(sequence[0:window])
-    min_gc = gc
-    max_gc = gc
-    for i in range(1, len(sequence) - window + 1, step):
-        section = sequence[i : min(i + window, len(sequence))]
-        gc = gc_content(section)
-        if gc < min_gc:
-            min_gc = gc
-        elif gc > max_gc:
-            max_gc = gc
-
-    return max_gc - min_gc
+    codes = base_codes(sequence)
+    if (codes > 3).any():
+        base = next(base for base in sequence if base not in "ACGT")
+        raise Exception(f"Sequence contains invalid symbol {base}.")
+
+    # A sequence shorter than the window is a single window over all of it.
+    window = min(window, len(sequence))
+    starts = np.concatenate(([0], np.arange(1, len(sequence) - window + 1, step)))
+    profile = window_gc(gc_sums(codes), window, starts)
+    return float(profile.max() - profile.min())
 
 
 def longest_homopolymer(sequence: str) -> int: